@@ -28,11 +28,68 @@ config['EDITED'] = os.path.join(config['BASE_DIR'], 'EDITED')
 os.makedirs(config['EDITED'], exist_ok=True)
 config['CHECK_FOLDER'] = os.path.join(config['BASE_DIR'], 'CHECK')
 os.makedirs(config['CHECK_FOLDER'], exist_ok=True)
+config['CACHE'] = os.path.join(config['BASE_DIR'], 'CACHE')
+config['RESPONSE_CACHE'] = os.path.join(config['CACHE'], 'responses')
+config['PREPROCESS_CACHE'] = os.path.join(config['CACHE'], 'preprocessed')
+config['LAYOUT_CACHE'] = os.path.join(config['CACHE'], 'layouts.json')
+config['TIKTOKEN_CACHE'] = os.path.join(config['CACHE'], 'tiktoken')
 config['CSS_PATH'] = "../../../../config/styles.css"
 config['JS_PATH'] = "../../../../config/scripts.js"
 config['crypto_env'] = os.path.join(config['CONFIG'], 'encrypted.env')
 config['TESTFILE'] = os.path.join(config['CONFIG'], 'test.json')
 config['GPTMODEL'] = 'gpt-4o-2024-08-06'
+config['workers'] = 1  # процессы предобработки main_edit (--workers)
+config['max_in_flight'] = 1  # одновременные запросы к openai (> 1 - асинхронный режим, --max_in_flight)
+# client-side rate limit openai (лимиты аккаунта для GPTMODEL)
+config['rate_rpm'] = 500  # requests per minute
+config['rate_tpm'] = 30000  # tokens per minute
+config['rate_max_concurrency'] = 8  # верхняя граница AIMD
+config['rate_max_retries'] = 5  # повторы после 429
+config['rate_default_backoff'] = 5.0  # пауза после 429 без Retry-After, сек
+config['request_timeout'] = 180  # дедлайн одного запроса к openai, сек
+config['hedge_enabled'] = False  # дублировать запрос, если он дольше hedge_percentile последних запросов
+config['hedge_percentile'] = 95
+config['hedge_min_samples'] = 10  # hedging включается после N завершенных запросов
+config['latency_window'] = 100  # окно длительностей запросов для перцентиля
+config['use_response_cache'] = True  # кэш ответов openai по хэшу входа (--no_cache)
+config['response_cache_max_mb'] = 200
+config['response_cache_max_age_days'] = 30
+config['chars_per_token'] = 3  # оценка токенов текста без токенизатора
+config['pipeline_queue_size'] = 4  # --pipeline: готовые папки EDITED, ожидающие извлечения
+config['page_workers'] = 3  # потоки обработки страниц одного документа (OSD, deskew, finishing)
+config['raster_backend'] = 'fitz'  # растеризация сканированных pdf: 'fitz' (в памяти) | 'poppler' (pdftoppm)
+config['raster_dpi'] = 200
+config['finishing_backend'] = 'native'  # обработка страниц: 'native' (OpenCV/PIL в процессе) | 'magick' (magick_opt)
+config['finishing_quality'] = 100
+config['finishing_dpi'] = 350
+config['osd_max_side'] = 1600  # OSD (поворот 0/90/180/270) по копии страницы не больше, px
+config['deskew_max_side'] = 1200  # deskew по копии страницы не больше, px
+config['deskew_engine'] = 'projection'  # 'projection' | 'hough' (hough теряет малые наклоны; src.rotator)
+config['deskew_min_angle'] = 0.1  # меньший наклон не исправляется (без warpAffine), градусы
+config['deskew_min_confidence'] = 0.2  # угол с меньшей уверенностью не применяется
+config['use_layout_cache'] = True  # координаты таблицы товаров известной формы - без OCR
+config['layout_max_distance'] = 24  # из 256 бит отпечатка разметки
+config['roi_compose'] = False  # одностраничный скан: страница без пустых полей (trim_page) вместо страницы + зума
+# (выключено: точность извлечения против страницы + зума таблицы не сравнивалась)
+config['roi_margin'] = 20  # поля вокруг обрезанных частей страницы, px
+config['roi_max_gap'] = 40  # пустые полосы выше - сжимаются до этой высоты, px
+config['container_regex'] = r'[A-ZА-Я]{3}U\s?[0-9]{6}-?[0-9]'  # номер контейнера (как в response_postprocessing)
+config['pdf_text_min_score'] = 0.7  # цифровой pdf с худшим текстом (CID и т.п.) обрабатывается как скан
+config['compact_pdf_text'] = True  # текст цифрового pdf без повторов между страницами и условий перевозки
+config['ocr_route'] = True  # чистый скан (локальный OCR) -> в модель текстом, а не изображениями
+config['ocr_route_min_words'] = 50
+config['ocr_route_min_conf'] = 90  # средняя уверенность tesseract по словам
+config['ocr_route_min_containers'] = 1  # номеров контейнеров в OCR-тексте не меньше
+config['doc_image_token_budget'] = 3500  # токены изображений одного документа (выбор detail low/high)
+config['overview_detail'] = 'low'  # вся страница одностраничного документа при наличии зума: 'low' | 'auto'
+config['api_image_format'] = 'JPEG'  # изображения для API: 'JPEG' | 'WEBP' | 'original' (как в EDITED)
+config['api_image_quality'] = 85
+config['artifact_registry_size'] = 32  # закодированные страницы в памяти до отправки (без повторного чтения файла)
+config['extract_embedded_images'] = True  # страница-скан: берем встроенное изображение без рендера (fitz)
+config['embedded_min_coverage'] = 0.9  # доля площади страницы, которую должно занимать изображение
+config['use_preprocess_cache'] = True  # результаты main_edit по хэшу исходного файла
+config['preprocess_cache_max_mb'] = 2000
+config['preprocess_cache_max_age_days'] = 14
 
 config['valid_ext'] = ['.pdf', '.jpg', '.jpeg', '.png']
 config['excel_ext'] = ['.xls', '.xltx', '.xlsx']
@@ -0,0 +1,63 @@
+import os
+import base64
+import threading
+from io import BytesIO
+from PIL import Image
+from collections import OrderedDict
+
+from config.config import config
+
+MIME_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp'}
+
+
+class ImageArtifact:
+    """ изображение между этапами: итоговые закодированные байты (+ декодированные пиксели, если есть).
+    На диск пишется только копия для проверки (path); payload для API собирается из тех же байтов """
+
+    def __init__(self, path: str, data: bytes, mime: str, pixels: Image.Image | None = None):
+        self.path = path
+        self.data = data
+        self.mime = mime
+        self.pixels = pixels
+
+    @classmethod
+    def from_file(cls, path: str) -> 'ImageArtifact':
+        """ байты файла без декодирования """
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        return cls(path, data, MIME_TYPES.get(os.path.splitext(path)[-1].lower(), 'image/jpeg'))
+
+    @property
+    def size(self) -> tuple[int, int]:
+        if self.pixels is not None:
+            return self.pixels.size
+        with Image.open(BytesIO(self.data)) as image:  # читается только заголовок
+            return image.size
+
+    def save(self) -> None:
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def data_url(self) -> str:
+        return f"data:{self.mime};base64,{base64.b64encode(self.data).decode('utf-8')}"
+
+
+# артефакты, созданные в этом процессе (main_edit без пула процессов, --pipeline): файл не читается повторно
+_registry: OrderedDict[str, ImageArtifact] = OrderedDict()
+_registry_lock = threading.Lock()
+
+
+def register_artifact(artifact: ImageArtifact) -> None:
+    """ хранятся только байты (без пикселей), не больше config['artifact_registry_size'] последних """
+
+    with _registry_lock:
+        _registry[os.path.abspath(artifact.path)] = ImageArtifact(artifact.path, artifact.data, artifact.mime)
+        while len(_registry) > config['artifact_registry_size']:
+            _registry.popitem(last=False)
+
+
+def load_artifact(path: str) -> ImageArtifact:
+    with _registry_lock:
+        artifact = _registry.pop(os.path.abspath(path), None)
+    return artifact if artifact is not None else ImageArtifact.from_file(path)
@@ -5,7 +5,9 @@ import pytesseract
 import numpy as np
 import pandas as pd
 from PIL import Image
-from pytesseract import Output
+from time import perf_counter
+
+from src.ocr_engine import ocr
 
 
 def extract_text_from_image(image: np.ndarray, psm=3):
@@ -23,14 +25,24 @@ rgx = (r"((?:place|port) of (?:loading|discharge|receipt|delivery))|((?:descript
        r"(particulars (?:declared|furnished) by (?:the)? shipper)")
 
 
-def get_table_coords(image: str | Image.Image, regex: str = rgx) -> dict | None:
+# окна поиска заголовка таблицы (доли высоты), расширяющиеся от середины страницы до всей страницы. На каждом шаге
+# распознаются только добавленные полосы - с перекрытием HEADER_OVERLAP, чтобы строка на границе попала целиком
+HEADER_WINDOWS = [(0.25, 0.65), (0.0, 0.75), (0.0, 1.0)]
+HEADER_OVERLAP = 0.03
+# полоса проверки координат из кэша разметки: выше и ниже ожидаемого min_top (доли высоты)
+HEADER_CHECK = (0.02, 0.06)
+
+
+def get_table_coords_full_page(image: str | Image.Image, regex: str = rgx) -> dict | None:
+    """ прежний поиск заголовка: OCR всей страницы, groupby.apply (для benchmark_table_coords) """
+
     def get_text_and_coords(group):
         text = " ".join(group['text'])
         min_left = group['left'].min()
         min_top = group['top'].min()
         return pd.Series({'text': text, 'min_left': min_left, 'min_top': min_top})
 
-    df = pytesseract.image_to_data(image, output_type=Output.DATAFRAME, lang='eng+rus')
+    df = ocr.data(image, lang='eng+rus')
     df = df[df['conf'] > 75]
     if df.isna().all().all():
         return None
@@ -51,6 +63,117 @@ def get_table_coords(image: str | Image.Image, regex: str = rgx) -> dict | None:
     return {'min_left': left, 'min_top': top}
 
 
+def ocr_lines(band: Image.Image, top: int, scale: float) -> pd.DataFrame:
+    """ строки (text, min_left, min_top, conf) полосы страницы с верхней границей top;
+    OCR уменьшенной в scale раз полосы, координаты - в пикселях исходной страницы """
+
+    small = band.resize((round(band.width * scale), round(band.height * scale)), Image.Resampling.LANCZOS)
+    df = ocr.data(small, lang='eng+rus')
+    df = df[(df['conf'] > 75) & df['text'].notna()]
+    df = df.assign(text=df['text'].astype(str))
+    lines = df.groupby(['page_num', 'block_num', 'level', 'line_num'], sort=False).agg(
+        text=('text', ' '.join), min_left=('left', 'min'), min_top=('top', 'min'), conf=('conf', 'mean'))
+    lines['min_left'] = (lines['min_left'] / scale).round().astype(int)
+    lines['min_top'] = (lines['min_top'] / scale).round().astype(int) + top
+    return lines.reset_index(drop=True)
+
+
+def new_strips(window: tuple[float, float], covered: tuple[float, float] | None) -> list[tuple[float, float]]:
+    """ полосы окна window, еще не распознанные в окне covered (доли высоты, с перекрытием HEADER_OVERLAP) """
+
+    top, bottom = window
+    if covered is None:
+        return [window]
+    strips = []
+    if top < covered[0]:
+        strips.append((top, min(covered[0] + HEADER_OVERLAP, bottom)))
+    if bottom > covered[1]:
+        strips.append((max(covered[1] - HEADER_OVERLAP, top), bottom))
+    return strips
+
+
+def locate_table_header(image: str | Image.Image, regex: str = rgx, scale: float = 0.75
+                        ) -> tuple[dict | None, float]:
+    """ заголовок таблицы товаров: OCR уменьшенных (scale) полос расширяющихся окон HEADER_WINDOWS.
+    Как в get_table_coords_full_page, берется строка с наибольшим номером группы regex (выше на странице - при
+    равных); расширение окон прекращается, как только найдена строка последней группы.
+    confidence - средняя уверенность tesseract по словам найденной строки (0..1) """
+
+    if isinstance(image, str):
+        image = Image.open(image)
+    top_group = re.compile(regex).groups
+    found, covered = [], None
+    for window in HEADER_WINDOWS:
+        for strip_top, strip_bottom in new_strips(window, covered):
+            top, bottom = round(image.height * strip_top), round(image.height * strip_bottom)
+            found.append(header_lines(ocr_lines(image.crop((0, top, image.width, bottom)), top, scale), regex))
+        covered = window
+        if any((matched['group_number'] == top_group).any() for matched in found):
+            break
+    return best_header(pd.concat(found))
+
+
+def header_lines(lines: pd.DataFrame, regex: str) -> pd.DataFrame:
+    """ строки ocr_lines, совпавшие с regex, с номером совпавшей группы (group_number) """
+
+    if lines.empty:
+        return lines.assign(group_number=pd.Series(dtype=int))
+    extracted = lines['text'].str.extract(regex, flags=re.IGNORECASE).notna()
+    lines = lines.assign(group_number=extracted.to_numpy().argmax(axis=1) + 1)
+    return lines[extracted.any(axis=1)]
+
+
+def best_header(matched: pd.DataFrame) -> tuple[dict | None, float]:
+    """ строка с наибольшим номером группы (выше на странице - при равных) -> (coords, confidence) """
+
+    if matched.empty:
+        return None, 0.0
+    best = matched.sort_values(['group_number', 'min_top'], ascending=[False, True], kind='stable').iloc[0]
+    header_top = int(best.min_top) - 50 if best.min_top - 50 > 0 else int(best.min_top)
+    return {'min_left': int(best.min_left), 'min_top': header_top}, round(float(best.conf) / 100, 3)
+
+
+def verify_table_header(image: Image.Image, coords: dict, regex: str = rgx, scale: float = 0.75
+                        ) -> tuple[dict | None, float]:
+    """ проверка координат из кэша разметки: OCR одной полосы (HEADER_CHECK доли высоты) у ожидаемого заголовка.
+    Заголовок найден - его (уточненные) coords и confidence, иначе (None, 0.0) """
+
+    top = max(int(coords['min_top']) - round(image.height * HEADER_CHECK[0]), 0)
+    bottom = min(int(coords['min_top']) + round(image.height * HEADER_CHECK[1]), image.height)
+    return best_header(header_lines(ocr_lines(image.crop((0, top, image.width, bottom)), top, scale), regex))
+
+
+def get_table_coords(image: str | Image.Image, regex: str = rgx) -> dict | None:
+    return locate_table_header(image, regex)[0]
+
+
+def benchmark_table_coords(image_paths: list[str]) -> dict:
+    """ locate_table_header против get_table_coords_full_page: время и расхождение min_top (px) """
+
+    times = {'full_page': [], 'bands': []}
+    diffs, found = [], {'full_page': 0, 'bands': 0}
+    for image_path in image_paths:
+        image = Image.open(image_path)
+        image.load()
+        start = perf_counter()
+        full_page = get_table_coords_full_page(image)
+        times['full_page'].append(perf_counter() - start)
+        start = perf_counter()
+        bands, confidence = locate_table_header(image)
+        times['bands'].append(perf_counter() - start)
+        found['full_page'] += full_page is not None
+        found['bands'] += bands is not None
+        if full_page is not None and bands is not None:
+            diffs.append(abs(int(full_page['min_top']) - bands['min_top']))
+        print(image_path, full_page, bands, confidence)
+
+    summary = {'pages': len(image_paths), 'found': found,
+               'mean_s': {k: round(float(np.mean(v)), 3) for k, v in times.items() if v},
+               'mean_min_top_diff': round(float(np.mean(diffs)), 1) if diffs else None}
+    print(summary)
+    return summary
+
+
 def crop_goods_table(image: Image.Image, coords):
     if coords is None:
         return image
@@ -59,3 +182,7 @@ def crop_goods_table(image: Image.Image, coords):
     x1, x2 = 0, img_w
     y1, y2 = coords['min_top'], img_h
     return image.crop((x1, y1, x2, y2))
+
+
+if __name__ == '__main__':
+    benchmark_table_coords(sys.argv[1:])
@@ -0,0 +1,115 @@
+import os
+import time
+import shutil
+import hashlib
+import threading
+
+from src.logger import logger
+
+
+def make_key(*parts: str | bytes) -> str:
+    """ sha256 от частей ключа (части разделяются, чтобы ('ab', 'c') != ('a', 'bc')) """
+
+    sha = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        sha.update(len(part).to_bytes(8, 'little'))
+        sha.update(part)
+    return sha.hexdigest()
+
+
+class DiskCache:
+    """ кэш на диске: root/<key>/<files>. Вытеснение по возрасту (max_age_days) и общему размеру (max_mb),
+    самые давно использованные записи удаляются первыми """
+
+    def __init__(self, root: str, max_mb: float, max_age_days: float):
+        self.root = root
+        self.max_bytes = max_mb * 1024 * 1024
+        self.max_age = max_age_days * 24 * 60 * 60
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def touch(self, key: str) -> None:
+        """ отметка использования записи (для вытеснения) """
+
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass
+
+    def get_text(self, key: str, name: str) -> str | None:
+        file_path = os.path.join(self.path(key), name)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        self.touch(key)
+        return text
+
+    def put_text(self, key: str, text: str, name: str) -> None:
+        """ атомарная запись: временный файл + os.replace """
+
+        entry = self.path(key)
+        os.makedirs(entry, exist_ok=True)
+        tmp_path = os.path.join(entry, f'{name}.{os.getpid()}-{threading.get_ident()}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, os.path.join(entry, name))
+
+    def delete(self, key: str) -> None:
+        shutil.rmtree(self.path(key), ignore_errors=True)
+
+    def get_dir(self, key: str, marker: str) -> str | None:
+        """ папка записи, если она полностью записана (есть marker) """
+
+        entry = self.path(key)
+        if not os.path.isfile(os.path.join(entry, marker)):
+            return None
+        self.touch(key)
+        return entry
+
+    def put_dir(self, key: str, files: dict[str, str], texts: dict[str, str]) -> None:
+        """ атомарная запись папки: files {имя в кэше: путь к файлу}, texts {имя в кэше: текст}.
+        Запись собирается во временной папке и переименовывается целиком """
+
+        entry = self.path(key)
+        if os.path.isdir(entry):  # уже записано (другим процессом)
+            return
+        tmp_entry = f'{entry}.{os.getpid()}-{threading.get_ident()}.tmp'
+        os.makedirs(tmp_entry, exist_ok=True)
+        try:
+            for name, file_path in files.items():
+                shutil.copyfile(file_path, os.path.join(tmp_entry, name))
+            for name, text in texts.items():
+                with open(os.path.join(tmp_entry, name), 'w', encoding='utf-8') as f:
+                    f.write(text)
+            os.replace(tmp_entry, entry)
+        except OSError:
+            if not os.path.isdir(entry):
+                raise
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    def evict(self) -> None:
+        with self.lock:
+            now = time.time()
+            entries = []  # [(mtime, size, path), ...]
+            for entry in os.scandir(self.root):
+                if not entry.is_dir() or entry.name.endswith('.tmp'):
+                    continue
+                size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                entries.append((entry.stat().st_mtime, size, entry.path))
+
+            total, removed = sum(size for _, size, _ in entries), 0
+            for mtime, size, path in sorted(entries):
+                if now - mtime > self.max_age or total > self.max_bytes:
+                    shutil.rmtree(path, ignore_errors=True)
+                    total -= size
+                    removed += 1
+            if removed:
+                logger.print(f'cache {os.path.basename(self.root)}: evicted {removed} entries')
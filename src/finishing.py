@@ -0,0 +1,81 @@
+import os
+import sys
+import cv2
+import tempfile
+import subprocess
+import numpy as np
+from io import BytesIO
+from PIL import Image
+from time import perf_counter
+
+from config.config import config
+from src.logger import logger
+from src.artifacts import ImageArtifact
+
+REC709_LUMA = np.array([[0.2126, 0.7152, 0.0722]])  # веса R, G, B (как -colorspace Gray в ImageMagick)
+
+
+def to_gray(image: Image.Image) -> Image.Image:
+    if image.mode == 'L':
+        return image
+    rgb = np.asarray(image.convert('RGB'))
+    return Image.fromarray(cv2.transform(rgb, REC709_LUMA))
+
+
+def finish_native(image: Image.Image, save_path: str) -> ImageArtifact:
+    """ аналог magick_opt в процессе: grayscale, качество JPEG и DPI в метаданных.
+    Кодирование один раз в память, на диск пишутся те же байты """
+
+    dpi = config['finishing_dpi']
+    gray = to_gray(image)
+    buffered = BytesIO()
+    gray.save(buffered, format='JPEG', quality=config['finishing_quality'], dpi=(dpi, dpi))
+    artifact = ImageArtifact(save_path, buffered.getvalue(), 'image/jpeg', pixels=gray)
+    artifact.save()
+    return artifact
+
+
+def finish_magick(image: Image.Image, save_path: str) -> ImageArtifact:
+    image.save(save_path, quality=100)
+    command = [config["magick_exe"], "convert", save_path, *config["magick_opt"], save_path]
+    subprocess.run(command)
+    return ImageArtifact.from_file(save_path)
+
+
+def finish_image(image: Image.Image, save_path: str, backend: str | None = None) -> ImageArtifact:
+    """ backend: 'native' | 'magick' (по умолчанию config['finishing_backend']) """
+
+    backend = backend or config['finishing_backend']
+    if backend == 'native':
+        return finish_native(image, save_path)
+    elif backend == 'magick':
+        return finish_magick(image, save_path)
+    else:
+        raise ValueError(f'unknown finishing backend: {backend}')
+
+
+def compare_finishing(image_path: str) -> dict:
+    """ сверка native и magick: среднее абсолютное отличие пикселей, размер файлов, DPI, время """
+
+    image = Image.open(image_path)
+    image.load()
+    result = {'image': image_path}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        finished = {}
+        for backend in ['native', 'magick']:
+            save_path = os.path.join(tmp_dir, f'{backend}.jpg')
+            start = perf_counter()
+            finish_image(image, save_path, backend)
+            result[f'{backend}_time'] = round(perf_counter() - start, 3)
+            result[f'{backend}_bytes'] = os.path.getsize(save_path)
+            with Image.open(save_path) as finished_image:
+                result[f'{backend}_dpi'] = finished_image.info.get('dpi')
+                finished[backend] = np.asarray(finished_image.convert('L'), dtype=np.int16)
+    result['mean_abs_diff'] = float(np.abs(finished['native'] - finished['magick']).mean())
+    logger.print(result)
+    return result
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        compare_finishing(path)
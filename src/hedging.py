@@ -0,0 +1,192 @@
+import asyncio
+import threading
+from collections import deque
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+
+import numpy as np
+
+
+class LatencyTracker:
+    """ скользящее окно длительностей последних запросов """
+
+    def __init__(self, window: int = 100, min_samples: int = 10):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self.lock:
+            self.samples.append(seconds)
+
+    def add_when_done(self, start: float):
+        """ callback для Future проигравшего запроса: длительность записывается, когда он завершится """
+
+        def callback(future: Future) -> None:
+            if not future.cancelled():
+                self.add(perf_counter() - start)
+        return callback
+
+    def percentile(self, q: float) -> float | None:
+        """ None, пока данных меньше min_samples """
+
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            return float(np.percentile(self.samples, q))
+
+
+class HedgeRejected(Exception):
+    """ дубликат не отправлен: rate limit не выдал слот сразу """
+
+
+class HedgeStats:
+    """ счетчики для настройки hedging: hedge rate, выигрыши дубликатов, потраченные впустую токены """
+
+    def __init__(self):
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.hedge_rejected = 0
+        self.cancelled = 0
+        self.timeouts = 0
+        self.wasted_tokens = 0
+        self.lock = threading.Lock()
+
+    def add(self, **counters: int) -> None:
+        with self.lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def add_wasted(self, future: Future) -> None:
+        """ callback проигравшего запроса: его токены оплачены, но не использованы """
+
+        if future.cancelled() or future.exception() is not None:
+            return
+        usage = getattr(future.result(), 'usage', None)
+        if usage is not None:
+            self.add(wasted_tokens=usage.total_tokens)
+
+    def summary(self) -> str:
+        rate = self.hedged / self.calls if self.calls else 0.0
+        return (f'hedging: calls {self.calls}, hedged {self.hedged} ({rate:.1%}), hedge wins {self.hedge_wins}, '
+                f'rejected by rate limit {self.hedge_rejected}, cancelled {self.cancelled}, timeouts {self.timeouts}, '
+                f'wasted tokens {self.wasted_tokens}')
+
+
+def is_valid_response(response) -> bool:
+    return bool(response.choices) and bool(response.choices[0].message.content)
+
+
+def hedged_call(call, deadline: float, hedge_after: float | None, tracker: LatencyTracker, stats: HedgeStats,
+                hedge_call=None):
+    """ call() с дедлайном deadline; если ответа нет за hedge_after сек - отправляется дубликат hedge_call()
+    (по умолчанию call; HedgeRejected - дубликат не отправлен). Побеждает первый валидный ответ, результат
+    проигравшего отбрасывается (его токены -> stats.wasted_tokens) """
+
+    stats.add(calls=1)
+    executor = ThreadPoolExecutor(max_workers=2)
+    start = perf_counter()
+    primary = executor.submit(call)
+    started = {primary: start}
+    pending = {primary}
+    hedged, last_error = False, None
+    try:
+        while pending:
+            now = perf_counter()
+            if now >= start + deadline:
+                stats.add(timeouts=1)
+                for future in pending:  # длительность оборванного запроса не меньше прошедшего времени
+                    tracker.add(now - started[future])
+                raise TimeoutError(f'no valid response in {deadline:.0f}s')
+            wake = start + deadline
+            if not hedged and hedge_after is not None:
+                wake = min(wake, start + hedge_after)
+            done, pending = wait(pending, timeout=wake - now, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    response = future.result()
+                except HedgeRejected:
+                    stats.add(hedge_rejected=1)
+                    continue
+                except Exception as error:
+                    last_error = error
+                    continue
+                if not is_valid_response(response):
+                    last_error = ValueError('empty response')
+                    continue
+                tracker.add(perf_counter() - started[future])
+                if future is not primary:
+                    stats.add(hedge_wins=1)
+                for loser in pending:
+                    stats.add(cancelled=int(loser.cancel()))
+                    loser.add_done_callback(stats.add_wasted)
+                    loser.add_done_callback(tracker.add_when_done(started[loser]))
+                return response
+
+            if pending and not hedged and hedge_after is not None and perf_counter() >= start + hedge_after:
+                hedged = True
+                stats.add(hedged=1)
+                hedge = executor.submit(hedge_call or call)
+                started[hedge] = perf_counter()
+                pending.add(hedge)
+        raise last_error
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def ahedged_call(call, deadline: float, hedge_after: float | None, tracker: LatencyTracker,
+                       stats: HedgeStats, hedge_call=None):
+    """ async hedged_call: call() -> coroutine; проигравший запрос отменяется """
+
+    stats.add(calls=1)
+    start = perf_counter()
+    primary = asyncio.create_task(call())
+    started = {primary: start}
+    pending = {primary}
+    hedged, last_error = False, None
+    try:
+        while pending:
+            now = perf_counter()
+            if now >= start + deadline:
+                stats.add(timeouts=1)
+                for task in pending:  # длительность оборванного запроса не меньше прошедшего времени
+                    tracker.add(now - started[task])
+                raise TimeoutError(f'no valid response in {deadline:.0f}s')
+            wake = start + deadline
+            if not hedged and hedge_after is not None:
+                wake = min(wake, start + hedge_after)
+            done, pending = await asyncio.wait(pending, timeout=wake - now, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                try:
+                    response = task.result()
+                except HedgeRejected:
+                    stats.add(hedge_rejected=1)
+                    continue
+                except Exception as error:
+                    last_error = error
+                    continue
+                if not is_valid_response(response):
+                    last_error = ValueError('empty response')
+                    continue
+                tracker.add(perf_counter() - started[task])
+                if task is not primary:
+                    stats.add(hedge_wins=1)
+                for loser in pending:  # длительность проигравшего не меньше прошедшего времени
+                    tracker.add(perf_counter() - started[loser])
+                    loser.cancel()
+                    stats.add(cancelled=1)
+                return response
+
+            if pending and not hedged and hedge_after is not None and perf_counter() >= start + hedge_after:
+                hedged = True
+                stats.add(hedged=1)
+                hedge = asyncio.create_task((hedge_call or call)())
+                started[hedge] = perf_counter()
+                pending.add(hedge)
+        raise last_error
+    finally:  # таймаут или ошибка: оставшиеся запросы отменяются (учтены в timeouts, не в cancelled)
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,47 @@
+from io import BytesIO
+from PIL import Image
+
+from config.config import config
+from src.artifacts import ImageArtifact
+from src.utils_tokens import estimate_image_tokens
+
+
+def vision_size(width: int, height: int, detail: str = 'high') -> tuple[int, int]:
+    """ разрешение, до которого модель сама уменьшает изображение:
+    high -> вписать в 2048x2048, затем короткая сторона 768; low -> вписать в 512x512 """
+
+    if detail == 'low':
+        scale = min(1.0, 512 / max(width, height))
+    else:
+        scale = min(1.0, 2048 / max(width, height))
+        scale *= min(1.0, 768 / (min(width, height) * scale))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def encode_for_api(artifact: ImageArtifact, detail: str = 'high') -> ImageArtifact:
+    """ изображение в эффективном разрешении модели, JPEG/WebP (config['api_image_format']).
+    'original' - байты артефакта без изменений """
+
+    image_format = config['api_image_format']
+    if image_format == 'original':
+        return artifact
+
+    image = artifact.pixels if artifact.pixels is not None else Image.open(BytesIO(artifact.data))
+    target = vision_size(*image.size, detail=detail)
+    if target != image.size:
+        image = image.resize(target, Image.LANCZOS)
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+
+    buffered = BytesIO()
+    image.save(buffered, format=image_format, quality=config['api_image_quality'])
+    return ImageArtifact(artifact.path, buffered.getvalue(), f'image/{image_format.lower()}', pixels=image)
+
+
+def payload_report(artifacts: list[ImageArtifact], details: list[str]) -> str:
+    """ размер payload и оценка токенов изображений запроса """
+
+    payload_bytes = sum((len(artifact.data) + 2) // 3 * 4 for artifact in artifacts)  # base64
+    tokens = sum(estimate_image_tokens(*artifact.size, detail) for artifact, detail in zip(artifacts, details))
+    sizes = ', '.join(f'{w}x{h}' for w, h in (artifact.size for artifact in artifacts))
+    return f'images payload: {len(artifacts)} images ({sizes}), {payload_bytes} bytes base64, ~{tokens} image tokens'
@@ -0,0 +1,67 @@
+import os
+import json
+import threading
+
+from src.logger import logger
+from src.utils import write_atomic
+
+
+class RunJournal:
+    """ журнал запуска CHECK/<date_folder>/journal.json: этап обработки каждого документа (папки EDITED).
+    Ответ openai хранится рядом (journal/<folder>.response), чтобы при --resume не платить за него повторно.
+    Все файлы пишутся атомарно (временный файл + os.replace) """
+
+    STAGES = ('preprocessed', 'extracted', 'postprocessed', 'exported')
+
+    def __init__(self, date_folder: str):
+        self.path = os.path.join(date_folder, 'journal.json')
+        self.responses = os.path.join(date_folder, 'journal')
+        self.lock = threading.Lock()
+        self.documents = dict()  # {folder_name: {'stage': ..., ...}}
+        if os.path.isfile(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.documents = json.load(f)
+            logger.print(f'journal: {len(self.completed())} of {len(self.documents)} documents already exported')
+
+    def is_done(self, folder_name: str, stage: str) -> bool:
+        done_stage = self.documents.get(folder_name, {}).get('stage')
+        return done_stage is not None and self.STAGES.index(done_stage) >= self.STAGES.index(stage)
+
+    def completed(self) -> set[str]:
+        return {name for name in self.documents if self.is_done(name, 'exported')}
+
+    def mark(self, folder_name: str, stage: str, **data) -> None:
+        with self.lock:
+            document = self.documents.setdefault(folder_name, dict())
+            document.update(data)
+            if not self.is_done(folder_name, stage):  # этап только продвигается вперед
+                document['stage'] = stage
+            write_atomic(self.path, json.dumps(self.documents, ensure_ascii=False, indent=4))
+
+    def mark_extracted(self, folder_name: str, response: str, params: dict) -> None:
+        os.makedirs(self.responses, exist_ok=True)
+        write_atomic(os.path.join(self.responses, f'{folder_name}.response'), response)
+        self.mark(folder_name, 'extracted', text_or_scanned_folder=params['text_or_scanned_folder'],
+                  route=params.get('route'))  # 'text' - скан отправлен OCR-текстом (src.ocr_route)
+
+    def discard_response(self, folder_name: str) -> None:
+        """ ответ не прошел постобработку: документ возвращается на этап preprocessed, при --resume
+        openai будет спрошен заново """
+
+        with self.lock:
+            self.documents.setdefault(folder_name, dict())['stage'] = 'preprocessed'
+            write_atomic(self.path, json.dumps(self.documents, ensure_ascii=False, indent=4))
+        response_path = os.path.join(self.responses, f'{folder_name}.response')
+        if os.path.isfile(response_path):
+            os.remove(response_path)
+
+    def response(self, folder_name: str, params: dict) -> str | None:
+        """ сохраненный ответ openai (если документ уже прошел extracted), восстанавливает params """
+
+        if not self.is_done(folder_name, 'extracted'):
+            return None
+        with open(os.path.join(self.responses, f'{folder_name}.response'), 'r', encoding='utf-8') as f:
+            response = f.read()
+        params['text_or_scanned_folder'] = self.documents[folder_name]['text_or_scanned_folder']
+        logger.print(f'journal: response of {folder_name} is restored')
+        return response
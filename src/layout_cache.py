@@ -0,0 +1,88 @@
+import os
+import cv2
+import json
+import threading
+import numpy as np
+from PIL import Image
+
+from src.logger import logger
+from src.utils import write_atomic, file_lock
+
+
+def layout_fingerprint(image: Image.Image, size: int = 16) -> int:
+    """ перцептивный хэш разметки: бинаризованная (Otsu) страница делится на size x size ячеек,
+    бит ячейки - плотность текста/линий выше медианной """
+
+    gray = np.asarray(image.convert('L'))
+    scale = 512 / max(gray.shape)
+    thumbnail = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    _, binary = cv2.threshold(thumbnail, 0, 1, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    density = cv2.resize(binary.astype(np.float32), (size, size), interpolation=cv2.INTER_AREA)
+    bits = (density > np.median(density)).ravel()
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+class LayoutCache:
+    """ CACHE/layouts.json: {fingerprint (hex): {'aspect', 'min_left', 'min_top' (доли ширины/высоты)}}.
+    Координаты таблицы для известной формы берутся без OCR. Поиск только читает файл (перечитывается, когда его
+    дополнил другой процесс main_edit); запись новой формы - перечитать + дополнить + атомарно заменить под
+    межпроцессной блокировкой (utils.file_lock) """
+
+    def __init__(self, path: str, max_distance: int, max_aspect_diff: float = 0.02):
+        self.path = path
+        self.max_distance = max_distance  # допустимое число отличающихся бит отпечатка
+        self.max_aspect_diff = max_aspect_diff
+        self.lock = threading.Lock()
+        self.layouts, self.mtime = {}, None
+
+    def load(self) -> dict:
+        """ содержимое файла; повторно читается, только если файл изменился """
+
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return {}
+        if mtime != self.mtime:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.layouts = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                return {}
+            self.mtime = mtime
+        return self.layouts
+
+    def find(self, layouts: dict, fingerprint: int, aspect: float) -> tuple[str | None, int]:
+        """ (ключ, расстояние Хэмминга) ближайшего отпечатка с той же пропорцией страницы """
+
+        best_key, best_distance = None, self.max_distance + 1
+        for key, layout in layouts.items():
+            if abs(layout['aspect'] - aspect) > self.max_aspect_diff:
+                continue
+            distance = (int(key, 16) ^ fingerprint).bit_count()
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        return best_key, best_distance
+
+    def lookup(self, image: Image.Image, fingerprint: int) -> dict | None:
+        """ table_coords в пикселях image (как get_table_coords) или None для незнакомой формы """
+
+        with self.lock:
+            layouts = self.load()
+            key, distance = self.find(layouts, fingerprint, image.height / image.width)
+            if key is None:
+                return None
+            layout = layouts[key]
+        # старшие биты - пустое поле сверху (нули): в логе - значащая часть ключа
+        logger.print(f'layout cache: hit {key.lstrip("0")[:12]}, distance {distance}/{len(key) * 4}')
+        return {'min_left': round(layout['min_left'] * image.width), 'min_top': round(layout['min_top'] * image.height)}
+
+    def store(self, image: Image.Image, fingerprint: int, table_coords: dict) -> None:
+        key = f'{fingerprint:064x}'
+        layout = {'aspect': round(image.height / image.width, 4),
+                  'min_left': round(int(table_coords['min_left']) / image.width, 4),
+                  'min_top': round(int(table_coords['min_top']) / image.height, 4)}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock, file_lock(self.path):
+            self.mtime = None  # под блокировкой - всегда свежая копия файла
+            layouts = {**self.load(), key: layout}
+            write_atomic(self.path, json.dumps(layouts, ensure_ascii=False, indent=4))
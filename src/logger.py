@@ -19,6 +19,10 @@ class Logger:
     def write(self, string_):
         self.data.append(string_ + '\n')
 
+    def extend(self, messages: list[str]):
+        # сообщения дочерних процессов (уже выведены в консоль) - только сохраняем в data
+        self.data.extend(messages)
+
     def save(self, log_folder):
         # Записываем логи в файл
         log_file = os.path.join(log_folder, 'log.log')
@@ -1,10 +1,14 @@
 import os
 import sys
+import asyncio
 import time
 import json
+import queue
 import shutil
 import msvcrt
 import argparse
+import threading
+import multiprocessing
 import traceback
 from glob import glob
 from itertools import count
@@ -14,11 +18,233 @@ from openai import PermissionDeniedError
 from config.config import config, running_params, NAMES
 from src.logger import logger
 from src.main_edit import main as main_edit
-from src.utils_openai import pdf_to_ai, excel_to_ai, images_to_ai
+from src.main_openai import hedge_stats, response_cache, discard_cached_response
+from src.utils_openai import pdf_to_ai, excel_to_ai, images_to_ai, apdf_to_ai, aexcel_to_ai, aimages_to_ai
 from src.generate_html import create_html_form
 from src.utils import create_date_folder_in_check
 from src.utils import convert_json_values_to_strings
 from src.response_postprocessing import local_postprocessing
+from src.journal import RunJournal
+
+
+def read_edited_folder(folder: str) -> tuple[list[str], str]:
+    """ returns (valid files of EDITED/<folder>, original file from params.json) """
+
+    files = os_sorted(glob(f"{folder}/*.*"))
+    files = [file for file in files if os.path.splitext(file)[-1] in config['valid_ext'] + config['excel_ext']]
+
+    with open(os.path.join(folder, 'params.json'), 'r', encoding='utf-8') as f:
+        params_dict = json.load(f)
+        original_file: str = params_dict['main_file']
+    return files, original_file
+
+
+def log_document(folder: str, files: list[str]) -> None:
+    logger.print('-' * 30)
+    logger.print('\nedited.folder:', folder, sep='\n')
+    logger.print('edited.files:', *files, sep='\n')
+
+
+def extract(files: list[str], test_mode: bool, text_to_assistant: bool, params: dict) -> str:
+    """ RUN MAIN_OPENAI.PY: pdf | excel | images -> openai response """
+
+    if os.path.splitext(files[0])[-1].lower() == '.pdf':  # достаточно проверить 1-й файл, чтобы определить .ext
+        pdf_file = files[0]
+        return pdf_to_ai(pdf_file, test_mode, text_to_assistant, config, params)
+    elif os.path.splitext(files[0])[-1].lower() in config['excel_ext']:
+        excel_file = files[0]
+        return excel_to_ai(excel_file, test_mode, text_to_assistant, config, params)
+    else:
+        return images_to_ai(files, test_mode, text_to_assistant, config, params)
+
+
+async def aextract(files: list[str], test_mode: bool, text_to_assistant: bool, params: dict) -> str:
+    """ async extract """
+
+    if os.path.splitext(files[0])[-1].lower() == '.pdf':
+        pdf_file = files[0]
+        return await apdf_to_ai(pdf_file, test_mode, text_to_assistant, config, params)
+    elif os.path.splitext(files[0])[-1].lower() in config['excel_ext']:
+        excel_file = files[0]
+        return await aexcel_to_ai(excel_file, test_mode, text_to_assistant, config, params)
+    else:
+        return await aimages_to_ai(files, test_mode, text_to_assistant, config, params)
+
+
+def save_result(result: str, folder_name: str, original_file: str, date_folder: str, params: dict,
+                journal: RunJournal) -> bool:
+    """ postprocessing + export; False if result is not json. A response that fails postprocessing or export
+    is discarded from the journal and the response cache, so --resume asks openai again """
+
+    try:
+        is_saved = export_result(result, folder_name, original_file, date_folder, params, journal)
+    except Exception:
+        journal.discard_response(folder_name)
+        discard_cached_response(result)
+        raise
+    if not is_saved:
+        journal.discard_response(folder_name)
+        discard_cached_response(result)
+    return is_saved
+
+
+def export_result(result: str, folder_name: str, original_file: str, date_folder: str, params: dict,
+                  journal: RunJournal) -> bool:
+    """ postprocessing of openai result, saving EXPORT json, original file and html. False if result is not json """
+
+    json_name = folder_name + '_' + '0' * 11 + '.json'
+
+    # _____________________ LOGS _____________________
+    logger.print('openai result:\n', repr(result))
+    with open(os.path.join(config['CONFIG'], 'openai_response_log.json'), 'w', encoding='utf-8') as f:
+        json.dump(json.loads(result), f, ensure_ascii=False, indent=4)
+
+    # _____________ LOCAL POSTPROCESSING _____________
+    result = local_postprocessing(result)
+
+    if result is None:
+        return False
+    journal.mark(folder_name, 'postprocessed')
+
+    # _____________ CONVERT VALUES TO STRING _____________
+    result = json.dumps(convert_json_values_to_strings(json.loads(result)), ensure_ascii=False, indent=4)
+
+    # _____ * SAVE JSON FILE * _____
+    local_check_folder: str = os.path.join(date_folder, params['text_or_scanned_folder'], folder_name)
+    os.makedirs(local_check_folder, exist_ok=True)  # может остаться от прерванного запуска (--resume)
+    json_path = os.path.join(date_folder, config['NAME_verified'], json_name)
+    with open(json_path, 'w', encoding='utf-8') as file:
+        file.write(result)
+
+    # _____ * COPY ORIGINAL FILE * _____
+    shutil.copy(original_file, os.path.join(local_check_folder, os.path.basename(original_file)))
+
+    # _____ * CREATE HTML FILE * _____
+    html_name = os.path.basename(local_check_folder) + '.html'
+    html_path = os.path.join(local_check_folder, html_name)
+    create_html_form(json_path, html_path, original_file)
+    journal.mark(folder_name, 'exported')
+    return True
+
+
+def extract_journaled(folder: str, files: list[str], original_file: str, test_mode: bool, text_to_assistant: bool,
+                      params: dict, journal: RunJournal) -> str:
+    """ extract with journal: response saved in journal is reused (--resume) """
+
+    folder_name = os.path.basename(folder)
+    journal.mark(folder_name, 'preprocessed', main_file=original_file)
+    result = journal.response(folder_name, params)
+    if result is None:
+        result = extract(files, test_mode, text_to_assistant, params)
+        journal.mark_extracted(folder_name, result, params)
+    return result
+
+
+def produce_edited(ready_queue: queue.Queue, hide_logs: bool, stop_when: int, workers: int,
+                   skip_folders: set[str]) -> None:
+    """ pipelined run: main_edit in a separate thread puts EDITED/<folder> to ready_queue, None - end of input """
+
+    try:
+        main_edit(hide_logs=hide_logs, stop_when=stop_when, workers=workers, ready_queue=ready_queue,
+                  skip_folders=skip_folders)
+    except Exception as error:
+        logger.print('ERROR IN MAIN_EDIT:', error)
+        logger.print(traceback.format_exc())
+    finally:
+        ready_queue.put(None)
+
+
+def iter_edited_folders(ready_queue: queue.Queue | None = None):
+    """ EDITED/<folder> paths: existing folders or (pipelined run) folders from ready_queue as they are ready """
+
+    if ready_queue is None:
+        yield from (folder_.path for folder_ in os.scandir(config['EDITED']))
+        return
+    while (folder := ready_queue.get()) is not None:
+        yield folder
+
+
+async def aiter_edited_folders(ready_queue: queue.Queue | None = None):
+    """ async iter_edited_folders """
+
+    if ready_queue is None:
+        for folder_ in os.scandir(config['EDITED']):
+            yield folder_.path
+        return
+    while True:
+        try:  # get с таймаутом: поток не зависает в ожидании, если извлечение прервано
+            folder = await asyncio.to_thread(ready_queue.get, timeout=1)
+        except queue.Empty:
+            continue
+        if folder is None:
+            return
+        yield folder
+
+
+async def extract_stage(date_folder: str,
+                        test_mode: bool,
+                        text_to_assistant: bool,
+                        stop_when: int,
+                        max_in_flight: int,
+                        journal: RunJournal,
+                        ready_queue: queue.Queue | None = None) -> int:
+    """ async extraction over EDITED with max_in_flight openai requests at once.
+    Postprocessing, EXPORT json and html are created as each response lands. Returns number of processed files """
+
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def process_document(folder: str) -> bool:
+        folder_name = os.path.basename(folder)
+        params = dict()  # running_params документа
+        try:
+            files, original_file = await asyncio.to_thread(read_edited_folder, folder)
+            # журнал пишется с fsync - в отдельном потоке, как и остальные блокирующие этапы
+            await asyncio.to_thread(journal.mark, folder_name, 'preprocessed', main_file=original_file)
+            result = await asyncio.to_thread(journal.response, folder_name, params)
+            if result is None:
+                async with semaphore:
+                    result = await aextract(files, test_mode, text_to_assistant, params)
+                await asyncio.to_thread(journal.mark_extracted, folder_name, result, params)
+            log_document(folder, files)
+            # html, копирование файлов - в отдельном потоке, не задерживая остальные запросы
+            return await asyncio.to_thread(save_result, result, folder_name, original_file, date_folder, params,
+                                           journal)
+        except PermissionDeniedError:
+            raise
+        except Exception as error:
+            logger.print('ERROR!:', folder, error)
+            logger.print(traceback.format_exc())
+            return False
+
+    tasks = []
+
+    def exported() -> int:
+        """ успешно экспортированные документы; PermissionDeniedError -> не ждем остальные папки """
+
+        for task in tasks:
+            if task.done() and task.exception() is not None:
+                raise task.exception()
+        return sum(task.result() for task in tasks if task.done())
+
+    try:
+        async for folder in aiter_edited_folders(ready_queue):
+            if journal.is_done(os.path.basename(folder), 'exported'):
+                continue
+            # stop_when считает экспортированные документы (как последовательный режим): новый документ
+            # запускается, только если экспортированных + находящихся в работе меньше stop_when
+            running = [task for task in tasks if not task.done()]
+            while stop_when > 0 and running and exported() + len(running) >= stop_when:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                running = [task for task in tasks if not task.done()]
+            if stop_when > 0 and exported() >= stop_when:
+                break
+            tasks.append(asyncio.create_task(process_document(folder)))
+            exported()
+        results = await asyncio.gather(*tasks)
+    finally:  # PermissionDeniedError -> отменяем оставшиеся запросы
+        for task in tasks:
+            task.cancel()
+    return sum(results)
 
 
 def main(date_folder: str,
@@ -26,81 +252,76 @@ def main(date_folder: str,
          test_mode: bool = False,
          use_existing: bool = False,
          text_to_assistant: bool = False,
-         stop_when: int = 0):
+         stop_when: int = 0,
+         workers: int = 1,
+         max_in_flight: int = 1,
+         pipeline: bool = False,
+         use_cache: bool = config['use_response_cache']):
     """
-    :param date_folder: folder for saving results
+    :param date_folder: folder for saving results; folder of an interrupted run (--resume): documents exported
+    there are skipped, openai responses saved in its journal are reused
     :param hide_logs: run without logs
     :param test_mode: run without main_openai using "config/__test.json"
     :param use_existing: run without main_edit using files in "IN/edited" folder
     :param text_to_assistant: do not use OCR to extract text from digital pdf, use loading pdf to assistant instead
     :param stop_when: stop script after N files
+    :param workers: number of processes for main_edit (preprocessing of IN folders)
+    :param max_in_flight: number of concurrent openai requests (1 - sequential run)
+    :param pipeline: run main_edit and extraction at the same time (folders are extracted as soon as preprocessed)
+    :param use_cache: use cached openai responses for already processed inputs (default - config['use_response_cache'])
     :return:
     """
 
     # _______ CONNECTION ________
     connection = 'http'
 
+    # _______ RESPONSE CACHE ________
+    config['use_response_cache'] = use_cache
+    if use_cache:
+        response_cache.evict()
+
+    # _______ RUN JOURNAL ________
+    journal = RunJournal(date_folder)
+    skip_folders = journal.completed()
+
     # _____  FILL IN_FOLDER_EDIT  _____
+    ready_queue = None
     if not use_existing:
-        main_edit(hide_logs=hide_logs, stop_when=stop_when)
+        if pipeline:
+            ready_queue = queue.Queue(maxsize=config['pipeline_queue_size'])
+            producer = threading.Thread(target=produce_edited,
+                                        args=(ready_queue, hide_logs, stop_when, workers, skip_folders), daemon=True)
+            producer.start()
+        else:
+            main_edit(hide_logs=hide_logs, stop_when=stop_when, workers=workers, skip_folders=skip_folders)
 
-    c, stop = count(1), 0
-    for folder_ in os.scandir(config['EDITED']):
-        folder, folder_name = folder_.path, folder_.name
+    if max_in_flight > 1:
+        stop = asyncio.run(extract_stage(date_folder, test_mode, text_to_assistant, stop_when, max_in_flight,
+                                         journal, ready_queue))
+        logger.print(hedge_stats.summary())
+        return (f'Обработано счетов: {stop}'
+                f'\n{date_folder}')
 
-        files = os_sorted(glob(f"{folder}/*.*"))
-        files = [file for file in files if os.path.splitext(file)[-1] in config['valid_ext'] + config['excel_ext']]
+    c, stop = count(1), 0
+    for folder in iter_edited_folders(ready_queue):
+        folder_name = os.path.basename(folder)
+        if journal.is_done(folder_name, 'exported'):
+            continue
 
-        with open(os.path.join(folder, 'params.json'), 'r', encoding='utf-8') as f:
-            params_dict = json.load(f)
-            original_file: str = params_dict['main_file']
+        files, original_file = read_edited_folder(folder)
 
         try:
             # _____  CREATE JSON  _____
-            logger.print('-' * 30)
-            logger.print('\nedited.folder:', folder, sep='\n')
-            logger.print('edited.files:', *files, sep='\n')
-            json_name = folder_name + '_' + '0' * 11 + '.json'
+            log_document(folder, files)
 
             # _____________ RUN MAIN_OPENAI.PY _____________
-            if os.path.splitext(files[0])[-1].lower() == '.pdf':  # достаточно проверить 1-й файл, чтобы определить .ext
-                pdf_file = files[0]
-                result = pdf_to_ai(pdf_file, test_mode, text_to_assistant, config, running_params)
-            elif os.path.splitext(files[0])[-1].lower() in config['excel_ext']:
-                excel_file = files[0]
-                result = excel_to_ai(excel_file, test_mode, text_to_assistant, config, running_params)
-            else:
-                result = images_to_ai(files, test_mode, text_to_assistant, config, running_params)
-
-            # _____________________ LOGS _____________________
-            logger.print('openai result:\n', repr(result))
-            with open(os.path.join(config['CONFIG'], 'openai_response_log.json'), 'w', encoding='utf-8') as f:
-                json.dump(json.loads(result), f, ensure_ascii=False, indent=4)
-
-            # _____________ LOCAL POSTPROCESSING _____________
-            result = local_postprocessing(result)
+            result = extract_journaled(folder, files, original_file, test_mode, text_to_assistant,
+                                       running_params, journal)
 
-            if result is None:
+            # _____________ LOCAL POSTPROCESSING, SAVE _____________
+            if not save_result(result, folder_name, original_file, date_folder, running_params, journal):
                 continue
 
-            # _____________ CONVERT VALUES TO STRING _____________
-            result = json.dumps(convert_json_values_to_strings(json.loads(result)), ensure_ascii=False, indent=4)
-
-            # _____ * SAVE JSON FILE * _____
-            local_check_folder: str = os.path.join(date_folder, running_params['text_or_scanned_folder'], folder_name)
-            os.makedirs(local_check_folder, exist_ok=False)
-            json_path = os.path.join(date_folder, config['NAME_verified'], json_name)
-            with open(json_path, 'w', encoding='utf-8') as file:
-                file.write(result)
-
-            # _____ * COPY ORIGINAL FILE * _____
-            shutil.copy(original_file, os.path.join(local_check_folder, os.path.basename(original_file)))
-
-            # _____ * CREATE HTML FILE * _____
-            html_name = os.path.basename(local_check_folder) + '.html'
-            html_path = os.path.join(local_check_folder, html_name)
-            create_html_form(json_path, html_path, original_file)
-
             # _____ clear temp variable running_params _____
             running_params.clear()
 
@@ -117,12 +338,15 @@ def main(date_folder: str,
             logger.print(traceback.format_exc())
             continue
 
+    logger.print(hedge_stats.summary())
+
     # _____  RESULT MESSAGE  _____
     return (f'Обработано счетов: {stop}'
             f'\n{date_folder}')
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # ProcessPoolExecutor в сборке (main_edit --workers)
     logger.print("CONFIG INFO:")
     logger.print('sys._MEIPASS:', hasattr(sys, '_MEIPASS'))
     logger.print(f'POPPLER_RPATH = {config["POPPLER_PATH"]}')
@@ -136,17 +360,34 @@ if __name__ == "__main__":
     parser.add_argument('--text_to_assistant', action='store_true', help='Обрабатывать цифровые pdf ассистентом')
     parser.add_argument('--no_exit', action='store_true', help='Не закрывать окно')
     parser.add_argument('--stop_when', type=int, default=-1, help='Максимальное количество файлов')
+    parser.add_argument('--max_in_flight', type=int, default=config['max_in_flight'],
+                        help='Количество одновременных запросов к openai')
+    parser.add_argument('--pipeline', action='store_true', help='Предобработка и извлечение одновременно')
+    parser.add_argument('--no_cache', action='store_true', help='Не использовать кэш ответов openai')
+    parser.add_argument('--resume', type=str, default=None,
+                        help='Продолжить прерванный запуск (папка даты в CHECK)')
+    parser.add_argument('--workers', type=int, default=config['workers'],
+                        help='Количество процессов предобработки (main_edit)')
     args = parser.parse_args()
     logger.print(args, end='\n\n')
 
-    date_folder = create_date_folder_in_check(config['CHECK_FOLDER'])
+    if args.resume:
+        date_folder = os.path.join(config['CHECK_FOLDER'], args.resume)
+        if not os.path.isdir(date_folder):
+            parser.error(f'--resume: папка {date_folder} не найдена')
+    else:
+        date_folder = create_date_folder_in_check(config['CHECK_FOLDER'])
     try:
         result_message = main(date_folder=date_folder,
                               hide_logs=args.hide_logs,
                               test_mode=args.test_mode,
                               use_existing=args.use_existing,
                               text_to_assistant=args.text_to_assistant,
-                              stop_when=args.stop_when)
+                              stop_when=args.stop_when,
+                              workers=args.workers,
+                              max_in_flight=args.max_in_flight,
+                              pipeline=args.pipeline,
+                              use_cache=config['use_response_cache'] and not args.no_cache)
         logger.print(f'\n{result_message}\n')
     except PermissionDeniedError:
         logger.print(traceback.format_exc())
@@ -1,121 +1,322 @@
 import os
 import glob
 import json
-import fitz
+import queue
 import shutil
 import traceback
-import subprocess
 import numpy as np
 from PIL import Image
-from itertools import count
-from pdf2image import convert_from_path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from config.config import config
-from src.crop_tables import get_table_coords, crop_goods_table
+from src.disk_cache import DiskCache, make_key
+from src.crop_tables import locate_table_header, verify_table_header, crop_goods_table
+from src.roi_composer import trim_page
+from src.layout_cache import LayoutCache, layout_fingerprint
+from src.ocr_route import choose_route
 from src.logger import logger
-from src.utils import delete_all_files, rename_files_in_directory, filtering_and_foldering_files
-from src.utils import is_scanned_pdf, count_pages, clear_pdf_waste_pages, image_upstanding_and_rotate
+from src.utils import delete_all_files, rename_files_in_directory, filtering_and_foldering_files, calculate_hash
+from src.utils import image_upstanding_and_rotate
+from src.pdf_profile import PdfProfile
+from src.rasterizer import rasterize_pdf
+from src.finishing import finish_image
+from src.artifacts import register_artifact
 
+# настройки, от которых зависит результат предобработки (входят в ключ кэша предобработки)
+PREPROCESS_OPTIONS = ['magick_opt', 'finishing_backend', 'finishing_quality', 'finishing_dpi',
+                      'raster_backend', 'raster_dpi', 'extract_embedded_images', 'embedded_min_coverage',
+                      'roi_compose', 'roi_margin', 'roi_max_gap',
+                      'osd_max_side', 'deskew_max_side', 'deskew_engine', 'deskew_min_angle', 'deskew_min_confidence',
+                      'ocr_route', 'ocr_route_min_words', 'ocr_route_min_conf', 'ocr_route_min_containers',
+                      'pdf_text_min_score', 'container_regex']
 
-def main(dir_path: str = config['IN_FOLDER'], hide_logs=False, stop_when=-1):
-    """ for folder in dir_path(IN), creates folder in EDITED, preprocess, extract additional and save to this folder """
+preprocess_cache = DiskCache(config['PREPROCESS_CACHE'], max_mb=config['preprocess_cache_max_mb'],
+                             max_age_days=config['preprocess_cache_max_age_days'])
 
-    # очистка EDITED
+layout_cache = LayoutCache(config['LAYOUT_CACHE'], max_distance=config['layout_max_distance'])
+
+# потоки страниц живут весь процесс: PyTessBaseAPI (ocr_engine) хранятся по потокам, и языки tesseract
+# загружаются один раз на поток, а не заново для каждого документа
+page_executor = ThreadPoolExecutor(max_workers=config['page_workers'], thread_name_prefix='page')
+
+
+def get_main_file(folder: str) -> str | None:
+    """ returns first file with valid extension in folder (IN/<folder>) or None """
+
+    if not os.path.isdir(folder):  # folder это не папка -> пропускаем
+        return None
+    if not os.listdir(folder):  # если пустая папка -> пропускам
+        return None
+    valid_types = config['valid_ext'] + config['excel_ext']
+    valid_files = [x for x in glob.glob(f"{folder}/*")
+                   if not os.path.isdir(x) and os.path.splitext(x)[-1] in valid_types]
+    if not valid_files:  # если нет ни одного файла с валидным расширением -> пропускам
+        return None
+    return valid_files[0]  # берем любой (первый) файл
+
+
+def preprocess_cache_key(main_file: str) -> str:
+    """ content hash исходного файла + настройки предобработки """
+
+    options = json.dumps({option: config[option] for option in PREPROCESS_OPTIONS}, sort_keys=True)
+    return make_key(calculate_hash(main_file), os.path.splitext(main_file)[-1].lower(), options)
+
+
+def restore_preprocessed(key: str, main_file: str, edited_folder: str) -> bool:
+    """ копирует результаты предобработки из кэша в edited_folder (с именами текущего main_file) """
+
+    entry = preprocess_cache.get_dir(key, 'meta.json')
+    if entry is None:
+        return False
+    with open(os.path.join(entry, 'meta.json'), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    stem = os.path.splitext(os.path.basename(main_file))[0]
+    for cached_name in meta['files']:  # '<stem>(0)_zoom.jpg' хранится как '(0)_zoom.jpg'
+        shutil.copyfile(os.path.join(entry, cached_name), os.path.join(edited_folder, stem + cached_name))
+    with open(os.path.join(edited_folder, 'params.json'), 'w', encoding='utf-8') as f:
+        json.dump({"main_file": main_file, **meta}, f, ensure_ascii=False, indent=4)
+    return True
+
+
+def store_preprocessed(key: str, main_file: str, local_files: list[str], params_dict: dict) -> None:
+    stem = os.path.splitext(os.path.basename(main_file))[0]
+    files = {os.path.basename(file)[len(stem):]: file for file in local_files}
+    meta = {k: v for k, v in params_dict.items() if k != 'main_file'}
+    meta['files'] = list(files)
+    preprocess_cache.put_dir(key, files=files, texts={'meta.json': json.dumps(meta, ensure_ascii=False, indent=4)})
+
+
+def find_table_coords(image: Image.Image) -> tuple[dict | None, dict]:
+    """ координаты таблицы товаров и источник: кэш разметки ('layout' - проверен OCR одной полосы у ожидаемого
+    заголовка) или поиск по странице ('ocr', дополняет кэш); confidence - уверенность OCR строки заголовка """
+
+    fingerprint = None
+    if config['use_layout_cache']:
+        fingerprint = layout_fingerprint(image)
+        table_coords = layout_cache.lookup(image, fingerprint)
+        if table_coords is not None:
+            table_coords, confidence = verify_table_header(image, table_coords)
+            if table_coords is not None:
+                return table_coords, {'source': 'layout', 'confidence': confidence}
+            logger.print('layout cache: no table header at the cached position, full search')
+    table_coords, confidence = locate_table_header(image)
+    if table_coords is not None and fingerprint is not None:
+        layout_cache.store(image, fingerprint, table_coords)
+    return table_coords, {'source': 'ocr', 'confidence': confidence}
+
+
+def finish_page(image: Image.Image, save_path: str) -> str:
+    """ finishing (grayscale, dpi) already oriented page and save to save_path """
+
+    register_artifact(finish_image(image, save_path))
+    return save_path
+
+
+def process_folder(folder_name: str, main_file: str) -> bool:
+    """ preprocess main_file of IN/<folder_name>, save results and params.json to EDITED/<folder_name> """
+
+    main_base = os.path.basename(main_file)
+    main_type = os.path.splitext(main_file)[-1]
+    print('main_file:', main_file)
+
+    edited_folder = os.path.join(config['EDITED'], folder_name)
+    main_save_path = os.path.join(edited_folder, main_base)
+    os.makedirs(edited_folder, exist_ok=False)
+    main_local_files = []  # список главных изображений (без _TAB1, _TAB2);
+    # Если scannedPDF + required_pages, то len(main_local_files) может быть > 1
+    extra_files = []  # прочие файлы EDITED/<folder>, которые сохраняются в кэш предобработки (OCR-текст)
+    profile = None
+
+    try:
+        # кэш предобработки: неизмененный файл не обрабатывается повторно
+        cache_key = preprocess_cache_key(main_file) if config['use_preprocess_cache'] else None
+        if cache_key and restore_preprocessed(cache_key, main_file, edited_folder):
+            logger.print(f'preprocess cache: hit {main_file}')
+            return True
+
+        params_dict = {"main_file": main_file, "table_coords": None}
+
+        # профиль pdf: текст, тип и чистые страницы за одно открытие файла
+        if main_type.lower() == '.pdf':
+            profile = PdfProfile(main_file)
+
+        # цифровой pdf с нечитаемым текстом (CID, мусор) растеризуется как скан
+        is_digital = profile is not None and not profile.is_scanned
+        if is_digital:
+            params_dict['text_quality'] = profile.text_quality
+            if profile.text_quality['score'] < config['pdf_text_min_score']:
+                logger.print(f'low text quality in {main_file}: {profile.text_quality} -> images')
+                is_digital = False
+
+        # if digital pdf
+        if is_digital:
+            print('file type: digital')
+            params_dict['doc_type'] = 'digital'
+            if profile.page_count > 7:
+                logger.print(f'page limit exceeded in {main_file}')
+                return False
+            profile.save_cleaned(main_save_path)
+            main_local_files.append(main_save_path)
+            # align_pdf_orientation(cleared_pdf_bytes, main_save_path)
+
+        # if file is (image | scanned pdf)
+        else:
+            images = []
+
+            if profile is not None:
+                print('file type: scanned pdf')
+                params_dict['doc_type'] = 'scanned'
+
+                # get first 3 pages
+                images = rasterize_pdf(main_file, last_page=3, document=profile.document)
+
+            elif main_type.lower() in ['.jpg', '.jpeg', '.png']:
+                images = [np.array(Image.open(main_file))]
+                params_dict['doc_type'] = 'image'
+
+            elif main_type.lower() in config['excel_ext']:
+                shutil.copy(main_file, main_save_path)
+                main_local_files.append(main_save_path)
+                params_dict['doc_type'] = 'excel'
+            else:
+                logger.print(f'main edit. ERROR IN: {main_file}')
+                return False
+
+            # страницы обрабатываются параллельно (page_executor), порядок сохраняется
+            if images:
+                # OSD + deskew один раз на страницу; transform сохраняется в params.json
+                oriented = list(page_executor.map(image_upstanding_and_rotate, images))
+                images = pages = [image for image, _ in oriented]
+                params_dict['orientation'] = [transform for _, transform in oriented]
+
+                # одностраничный документ: страница без пустых полей (roi) или страница + зум таблицы
+                postfix = ''
+                if len(images) == 1:
+                    rotated = images[0]
+                    table_coords, params_dict['table_search'] = find_table_coords(rotated)
+                    if table_coords is not None:
+                        params_dict['table_coords'] = {k: int(v) for k, v in table_coords.items()}
+                    if config['roi_compose']:
+                        images = [trim_page(rotated, table_coords)]
+                        postfix = '_roi'
+                    else:
+                        images = [rotated, crop_goods_table(rotated, table_coords)]
+                        postfix = '_zoom'
+
+                name, ext = os.path.splitext(main_save_path)
+                save_paths = [f'{name}({i}){postfix}.jpg' for i in range(len(images))]
+                main_local_files.extend(page_executor.map(finish_page, images, save_paths))
+
+                # чистый скан уходит в модель текстом локального OCR (images_to_ai), остальные - изображениями
+                if config['ocr_route']:
+                    try:
+                        params_dict['route'], text, params_dict['ocr'] = choose_route(
+                            pages, [image.size for image in images], map_=page_executor.map)
+                    except Exception as error:  # маршрут - оптимизация: ошибка OCR не должна терять документ
+                        params_dict['route'], text, params_dict['ocr'] = 'image', '', {'error': repr(error)}
+                    logger.print(f"ocr route: {params_dict['route']} {params_dict['ocr']}")
+                    if params_dict['route'] == 'text':
+                        with open(f'{name}_ocr.txt', 'w', encoding='utf-8') as f:
+                            f.write(text)
+                        extra_files.append(f'{name}_ocr.txt')
+
+        if cache_key:
+            store_preprocessed(cache_key, main_file, main_local_files + extra_files, params_dict)
+
+        with open(os.path.join(edited_folder, 'params.json'), 'w', encoding='utf-8') as f:
+            json.dump(params_dict, f, ensure_ascii=False, indent=4)
+    except:
+        logger.print("ERROR IN MAIN_EDIT:", traceback.format_exc(), sep='\n')
+        return False
+    finally:
+        if profile is not None:
+            profile.close()
+        print('------------------------------')
+
+    return True
+
+
+def process_folder_worker(folder_name: str, main_file: str) -> tuple[bool, list[str]]:
+    """ process_folder для ProcessPoolExecutor: возвращает результат и сообщения логгера дочернего процесса """
+
+    log_start = len(logger.data)
+    try:
+        is_done = process_folder(folder_name, main_file)
+    except:
+        logger.print("ERROR IN MAIN_EDIT:", traceback.format_exc(), sep='\n')
+        is_done = False
+    return is_done, logger.data[log_start:]
+
+
+def main(dir_path: str = config['IN_FOLDER'], hide_logs=False, stop_when=-1, workers=1,
+         ready_queue: queue.Queue | None = None, skip_folders: set[str] = frozenset()):
+    """ for folder in dir_path(IN), creates folder in EDITED, preprocess, extract additional and save to this folder
+
+    :param workers: number of processes for preprocessing folders (1 - sequential run in current process)
+    :param ready_queue: bounded queue for pipelined run: EDITED/<folder> path is put as soon as params.json is written
+    (put blocks when queue is full -> preprocessing does not run far ahead of extraction)
+    :param skip_folders: folders already exported in the resumed run (are not preprocessed)
+    """
+
+    # очистка EDITED (результаты предыдущих запусков берутся из кэша предобработки)
     delete_all_files(config['EDITED'])
+    if config['use_preprocess_cache']:
+        preprocess_cache.evict()
     # переименование файлов и папок
     rename_files_in_directory(dir_path, hide_logs=hide_logs)
     # упаковка одиночных файлов в папки
     filtering_and_foldering_files(dir_path)
 
-    c = count(1)
-
+    tasks = []  # [(folder_name, main_file), ...]
     for folder_ in os.scandir(dir_path):
-        if not os.path.isdir(folder_):  # folder_ это не папка -> пропускаем
-            continue
-        if not os.listdir(folder_):  # если пустая папка -> пропускам
-            continue
-        folder, folder_name = folder_.path, folder_.name
-        valid_types = config['valid_ext'] + config['excel_ext']
-        valid_files = [x for x in glob.glob(f"{folder}/*")
-                       if not os.path.isdir(x) and os.path.splitext(x)[-1] in valid_types]
-        if not valid_files:  # если нет ни одного файла с валидным расширением -> пропускам
+        if folder_.name in skip_folders:
             continue
-        main_file = valid_files[0]  # берем любой (первый) файл
-        main_base = os.path.basename(main_file)
-        main_type = os.path.splitext(main_file)[-1]
-        print('main_file:', main_file)
-
-        edited_folder = os.path.join(config['EDITED'], folder_name)
-        main_save_path = os.path.join(edited_folder, main_base)
-        os.makedirs(edited_folder, exist_ok=False)
-        main_local_files = []  # список главных изображений (без _TAB1, _TAB2);
-        # Если scannedPDF + required_pages, то len(main_local_files) может быть > 1
-
-        try:
-            # if digital pdf
-            if (main_type.lower() == '.pdf') and (is_scanned_pdf(main_file) is False):
-                print('file type: digital')
-                if count_pages(main_file) > 7:
-                    logger.print(f'page limit exceeded in {main_file}')
-                    continue
-                cleared_pdf_bytes = clear_pdf_waste_pages(main_file)
-                fitz.open("pdf", cleared_pdf_bytes).save(main_save_path)
-                # align_pdf_orientation(cleared_pdf_bytes, main_save_path)
-
-            # if file is (image | scanned pdf)
-            else:
-                images = []
+        main_file = get_main_file(folder_.path)
+        if main_file is not None:
+            tasks.append((folder_.name, main_file))
 
-                if main_type.lower() == '.pdf':
-                    print('file type: scanned pdf')
+    # _____  STOP ITERATION  _____
+    if stop_when > 0:
+        tasks = tasks[:stop_when]
 
-                    # get first 3 pages
-                    images = convert_from_path(main_file, first_page=0, last_page=3, fmt='jpg',
-                                               jpegopt={"quality": 100},
-                                               poppler_path=config["POPPLER_PATH"])
-                    images = list(map(lambda x: np.array(x), images))
+    def on_ready(folder_name: str) -> None:
+        if ready_queue is not None:
+            ready_queue.put(os.path.join(config['EDITED'], folder_name))
 
-                elif main_type.lower() in ['.jpg', '.jpeg', '.png']:
-                    images = [np.array(Image.open(main_file))]
+    if workers <= 1:
+        for folder_name, main_file in tasks:
+            if process_folder(folder_name, main_file):
+                on_ready(folder_name)
+        return
 
-                elif main_type.lower() in config['excel_ext']:
-                    shutil.copy(main_file, main_save_path)
-                else:
-                    logger.print(f'main edit. ERROR IN: {main_file}')
-                    continue
+    # в работе не больше workers папок: новая папка отправляется в пул после завершения предыдущей
+    tasks = iter(tasks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
 
-                # добавляем зумированное изображение в случае одностраничного документа
-                postfix = ''
-                if len(images) == 1:
-                    image = images[0]
-                    rotated = image_upstanding_and_rotate(image)
-                    table_coords = get_table_coords(rotated)
-                    cropped = crop_goods_table(rotated, table_coords)
-                    images = [rotated, cropped]
-                    postfix = '_zoom'
-
-                for i, image in enumerate(images):
-                    rotated = image_upstanding_and_rotate(image)
-                    name, ext = os.path.splitext(main_save_path)
-                    idx_save_path = f'{name}({i}){postfix}.jpg'
-                    rotated.save(idx_save_path, quality=100)
-                    main_local_files.append(idx_save_path)
-
-                    command = [config["magick_exe"], "convert", idx_save_path, *config["magick_opt"], idx_save_path]
-                    subprocess.run(command)
-
-            with open(os.path.join(edited_folder, 'params.json'), 'w', encoding='utf-8') as f:
-                params_dict = {"main_file": main_file}
-                json.dump(params_dict, f, ensure_ascii=False, indent=4)
-        except:
-            logger.print("ERROR IN MAIN_EDIT:", traceback.format_exc(), sep='\n')
+        def submit_next() -> None:
+            for folder_name, main_file in tasks:
+                futures[executor.submit(process_folder_worker, folder_name, main_file)] = folder_name
+                return
 
-        print('------------------------------')
-        # _____  STOP ITERATION  _____
-        if stop_when > 0:
-            stop = next(c)
-            if stop == stop_when:
-                break
+        for _ in range(workers):
+            submit_next()
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                folder_name = futures.pop(future)
+                try:
+                    is_done, messages = future.result()
+                except Exception as error:  # упал сам процесс (BrokenProcessPool и т.п.)
+                    logger.print(f'ERROR IN MAIN_EDIT WORKER ({folder_name}):', error)
+                    is_done, messages = False, []
+                logger.extend(messages)
+                if is_done:
+                    on_ready(folder_name)
+                else:
+                    logger.print(f'main edit. folder failed: {folder_name}')
+                submit_next()
 
 
 if __name__ == '__main__':
@@ -1,16 +1,24 @@
 import openai
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from openai.types.chat import ChatCompletion, ParsedChatCompletion
 
 import os
-from PIL import Image
+import json
+import asyncio
 from time import perf_counter
+from itertools import count
 from dotenv import load_dotenv
 
 from src.logger import logger
 from config.config import config, running_params
-from src.utils import extract_text_with_fitz, base64_encode_pil
+from src.utils import extract_text_with_fitz, handling_openai_json
+from src.token_planner import ImagePlan, plan_images
+from src.image_encoder import encode_for_api, payload_report
 from src.utils_config import get_stream_dotenv
+from src.utils_tokens import estimate_request_tokens
+from src.rate_limiter import RateGovernor, retry_after_seconds, is_quota_exceeded
+from src.disk_cache import DiskCache, make_key
+from src.hedging import LatencyTracker, HedgeStats, HedgeRejected, hedged_call, ahedged_call
 
 # ___________________________ general ___________________________
 
@@ -18,20 +26,211 @@ start = perf_counter()
 load_dotenv(stream=get_stream_dotenv())
 openai.api_key = os.environ.get("OPENAI_API_KEY")
 ASSISTANT_ID = os.environ.get("ASSISTANT_ID")
-client = OpenAI()
+# max_retries=0: повторы при 429 делает create_governed (через лимиты governor и Retry-After), а не SDK
+client = OpenAI(max_retries=0)
+aclient = AsyncOpenAI(max_retries=0)  # для асинхронного режима извлечения (main.main max_in_flight > 1)
+assistant_client = client.with_options(max_retries=2)  # run_assistant идет мимо governor: повторы SDK
+governor = RateGovernor(rpm=config['rate_rpm'], tpm=config['rate_tpm'],
+                        max_concurrency=config['rate_max_concurrency'])
+latency_tracker = LatencyTracker(window=config['latency_window'], min_samples=config['hedge_min_samples'])
+hedge_stats = HedgeStats()
+response_cache = DiskCache(config['RESPONSE_CACHE'], max_mb=config['response_cache_max_mb'],
+                           max_age_days=config['response_cache_max_age_days'])
 
 
-def log_response(response: ChatCompletion | ParsedChatCompletion, time_start: float) -> None:
+def log_response(response: ChatCompletion | ParsedChatCompletion, time_start: float,
+                 planned_tokens: int | None = None) -> None:
     logger.print('chat model:', response.model)
     logger.print(f'completion_tokens: {response.usage.completion_tokens}')
     logger.print(f'cached_tokens: {response.usage.prompt_tokens_details}')
     logger.print(f'prompt_tokens: {response.usage.prompt_tokens}')
+    if planned_tokens is not None:  # калибровка оценки токенов (token_planner, utils_tokens)
+        logger.print(f'planned_prompt_tokens: {planned_tokens}, actual/planned: '
+                     f'{response.usage.prompt_tokens / max(planned_tokens, 1):.2f}')
     logger.print(f'total_tokens: {response.usage.total_tokens}')
     logger.print(f'time: {perf_counter() - time_start:.2f}')
 
 
+# ___________________________ RATE LIMIT ___________________________
+
+def request_tokens(prompt: str, content: str | list, plan: ImagePlan | None, response_format) -> int:
+    """ оценка prompt-токенов запроса (для governor + max_tokens) """
+
+    if plan is None:
+        return estimate_request_tokens(prompt, content, response_format=response_format)
+    return estimate_request_tokens(prompt, content, plan.sizes, plan.details, response_format=response_format)
+
+
+def handle_rate_limit(error: openai.RateLimitError, attempt: int) -> None:
+    """ 429: сообщаем governor (AIMD + Retry-After); raise, если повторять нельзя """
+
+    retry_after = retry_after_seconds(error, default=config['rate_default_backoff'])
+    governor.release(throttled=True, retry_after=retry_after)
+    logger.print(f'rate limit (429): retry after {retry_after:.1f}s, attempt {attempt}, '
+                 f'concurrency limit {governor.limit:.1f}')
+    if is_quota_exceeded(error) or attempt > config['rate_max_retries']:
+        raise error
+
+
+# ___________________________ DEADLINE / HEDGING ___________________________
+
+def hedge_after() -> float | None:
+    """ задержка отправки дубликата: перцентиль длительности последних запросов (None - без hedging) """
+
+    if not config['hedge_enabled']:
+        return None
+    return latency_tracker.percentile(config['hedge_percentile'])
+
+
+def governed_hedge(create, tokens: int, **kwargs):
+    """ дубликат для hedged_call: слот governor (RPM/TPM, concurrency) берется только если он свободен сразу,
+    иначе HedgeRejected - при исчерпанных лимитах дубликат не отправляется """
+
+    if governor.try_acquire(tokens) > 0:
+        raise HedgeRejected()
+    try:
+        response = create(**kwargs)
+    except openai.RateLimitError as error:
+        governor.release(throttled=True, retry_after=retry_after_seconds(error, default=config['rate_default_backoff']))
+        raise
+    except BaseException:
+        governor.release(succeeded=False)
+        raise
+    governor.release()
+    return response
+
+
+async def agoverned_hedge(create, tokens: int, **kwargs):
+    """ async governed_hedge """
+
+    if governor.try_acquire(tokens) > 0:
+        raise HedgeRejected()
+    try:
+        response = await create(**kwargs)
+    except openai.RateLimitError as error:
+        governor.release(throttled=True, retry_after=retry_after_seconds(error, default=config['rate_default_backoff']))
+        raise
+    except BaseException:
+        governor.release(succeeded=False)
+        raise
+    governor.release()
+    return response
+
+
+def create_governed(create, tokens: int, **kwargs):
+    """ create(**kwargs) через governor; при 429 - пауза и повтор. Дедлайн и hedging отсчитываются
+    после получения слота governor, а не с ожидания в его очереди; дубликат берет свой слот (governed_hedge) """
+
+    for attempt in count(1):
+        governor.acquire(tokens)
+        try:
+            response = hedged_call(lambda: create(**kwargs), deadline=config['request_timeout'],
+                                   hedge_after=hedge_after(), tracker=latency_tracker, stats=hedge_stats,
+                                   hedge_call=lambda: governed_hedge(create, tokens, **kwargs))
+        except openai.RateLimitError as error:
+            handle_rate_limit(error, attempt)
+            continue
+        except BaseException:
+            governor.release(succeeded=False)
+            raise
+        governor.release()
+        return response
+
+
+async def acreate_governed(create, tokens: int, **kwargs):
+    """ async create_governed """
+
+    for attempt in count(1):
+        await governor.aacquire(tokens)
+        try:
+            response = await ahedged_call(lambda: create(**kwargs), deadline=config['request_timeout'],
+                                          hedge_after=hedge_after(), tracker=latency_tracker, stats=hedge_stats,
+                                          hedge_call=lambda: agoverned_hedge(create, tokens, **kwargs))
+        except openai.RateLimitError as error:
+            handle_rate_limit(error, attempt)
+            continue
+        except BaseException:
+            governor.release(succeeded=False)
+            raise
+        governor.release()
+        return response
+
+
+def call_chat(create, tokens: int, **kwargs):
+    """ create_governed с дедлайном config['request_timeout'] и hedging """
+
+    return create_governed(create, tokens, timeout=config['request_timeout'], **kwargs)
+
+
+async def acall_chat(create, tokens: int, **kwargs):
+    """ async call_chat """
+
+    return await acreate_governed(create, tokens, timeout=config['request_timeout'], **kwargs)
+
+
+# ___________________________ RESPONSE CACHE ___________________________
+
+def response_cache_key(model: str, prompt: str, content: str | list, response_format) -> str:
+    """ ключ кэша: подготовленный вход модели (текст или base64 изображений) + модель + промпт + схема ответа """
+
+    if hasattr(response_format, 'model_json_schema'):  # pydantic
+        response_format = response_format.model_json_schema()
+    return make_key(model, prompt, json.dumps(content, ensure_ascii=False),
+                    json.dumps(response_format, ensure_ascii=False, sort_keys=True))
+
+
+response_keys: dict[str, str] = dict()  # ответ -> ключ кэша, из которого он получен / в который записан
+
+
+def get_cached_response(key: str) -> str | None:
+    if not config['use_response_cache']:
+        return None
+    response = response_cache.get_text(key, 'response.json')
+    if response is not None:
+        logger.print(f'response cache: hit {key[:12]}')
+        response_keys[response] = key
+    return response
+
+
+def put_cached_response(key: str, response: str) -> None:
+    """ в кэш попадают только ответы, из которых извлекается json """
+
+    if config['use_response_cache'] and handling_openai_json(response, hide_logs=True) is not None:
+        response_cache.put_text(key, response, 'response.json')
+        response_keys[response] = key
+
+
+def discard_cached_response(response: str) -> None:
+    """ ответ не прошел постобработку: удаляется из кэша, следующий запуск спросит openai заново """
+
+    key = response_keys.pop(response, None)
+    if key is not None:
+        response_cache.delete(key)
+        logger.print(f'response cache: discarded {key[:12]}')
+
+
 # ___________________________ CHAT (json_schema) ___________________________
 
+def build_content(*file_paths: str, text_content: list | None = None) -> tuple[str | list[dict], ImagePlan | None]:
+    """ user message content: joined text or list of images (detail по плану token_planner) """
+
+    if text_content:
+        return '\n'.join(text_content), None
+    plan = plan_images(*file_paths)
+    content, artifacts = [], []
+    for artifact, detail in zip(plan.artifacts, plan.details):
+        artifact = encode_for_api(artifact, detail=detail)  # разрешение, которое видит модель
+        artifacts.append(artifact)
+        d = {
+            "type": "image_url",
+            "image_url": {"url": artifact.data_url(),
+                          "detail": detail}
+        }
+        content.append(d)
+    logger.print(payload_report(artifacts, plan.details))
+    return content, plan
+
+
 def run_chat(*file_paths: str,
              response_format,
              prompt=config['system_prompt'],
@@ -39,19 +238,17 @@ def run_chat(*file_paths: str,
              text_content: list | None = None
              ) -> str:
 
-    if text_content:
-        content = '\n'.join(text_content)
-    else:
-        content = []
-        for img_path in file_paths:
-            d = {
-                "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{base64_encode_pil(Image.open(img_path))}",
-                              "detail": "high"}
-            }
-            content.append(d)
+    content, plan = build_content(*file_paths, text_content=text_content)
 
-    response = client.chat.completions.create(
+    key = response_cache_key(model, prompt, content, response_format)
+    if (cached := get_cached_response(key)) is not None:
+        return cached
+
+    planned_tokens = request_tokens(prompt, content, plan, response_format=response_format)
+    tokens = planned_tokens + 3000  # max_tokens тоже учитывается в TPM
+    response = call_chat(
+        client.chat.completions.create,
+        tokens,
         model=model,
         temperature=0.1,
         messages=[
@@ -62,9 +259,10 @@ def run_chat(*file_paths: str,
         response_format=response_format,
     )
 
-    log_response(response=response, time_start=start)
+    log_response(response=response, time_start=start, planned_tokens=planned_tokens)
 
     response = response.choices[0].message.content
+    put_cached_response(key, response)
     return response
 
 
@@ -75,19 +273,17 @@ def run_chat_pydantic(*file_paths: str,
                       text_content: list | None = None,
                       ) -> str:
 
-    if text_content:
-        content = '\n'.join(text_content)
-    else:
-        content = []
-        for img_path in file_paths:
-            d = {
-                "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{base64_encode_pil(Image.open(img_path))}",
-                              "detail": "high"}
-            }
-            content.append(d)
+    content, plan = build_content(*file_paths, text_content=text_content)
+
+    key = response_cache_key(model, prompt, content, response_format_pydantic)
+    if (cached := get_cached_response(key)) is not None:
+        return cached
 
-    response = client.beta.chat.completions.parse(
+    planned_tokens = request_tokens(prompt, content, plan, response_format=response_format_pydantic)
+    tokens = planned_tokens + 3000  # max_tokens тоже учитывается в TPM
+    response = call_chat(
+        client.beta.chat.completions.parse,
+        tokens,
         model=model,
         temperature=0.1,
         messages=[
@@ -98,9 +294,47 @@ def run_chat_pydantic(*file_paths: str,
         response_format=response_format_pydantic,
     )
 
-    log_response(response=response, time_start=start)
+    log_response(response=response, time_start=start, planned_tokens=planned_tokens)
+
+    response = response.choices[0].message.content
+    put_cached_response(key, response)
+    return response
+
+
+async def arun_chat(*file_paths: str,
+                    response_format,
+                    prompt=config['system_prompt'],
+                    model=config['GPTMODEL'],
+                    text_content: list | None = None
+                    ) -> str:
+    """ async run_chat (AsyncOpenAI) """
+
+    time_start = perf_counter()
+    content, plan = await asyncio.to_thread(build_content, *file_paths, text_content=text_content)
+
+    key = response_cache_key(model, prompt, content, response_format)
+    if (cached := get_cached_response(key)) is not None:
+        return cached
+
+    planned_tokens = request_tokens(prompt, content, plan, response_format=response_format)
+    tokens = planned_tokens + 3000  # max_tokens тоже учитывается в TPM
+    response = await acall_chat(
+        aclient.chat.completions.create,
+        tokens,
+        model=model,
+        temperature=0.1,
+        messages=[
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": content}
+        ],
+        max_tokens=3000,
+        response_format=response_format,
+    )
+
+    log_response(response=response, time_start=time_start, planned_tokens=planned_tokens)
 
     response = response.choices[0].message.content
+    put_cached_response(key, response)
     return response
 
 
@@ -109,10 +343,10 @@ def run_chat_pydantic(*file_paths: str,
 def run_assistant(file_path):
     running_params['current_texts'] = extract_text_with_fitz(file_path)
 
-    assistant = client.beta.assistants.retrieve(assistant_id=ASSISTANT_ID)
-    message_file = client.files.create(file=open(file_path, "rb"), purpose="assistants")
+    assistant = assistant_client.beta.assistants.retrieve(assistant_id=ASSISTANT_ID)
+    message_file = assistant_client.files.create(file=open(file_path, "rb"), purpose="assistants")
     # Create a thread and attach the file to the message
-    thread = client.beta.threads.create(
+    thread = assistant_client.beta.threads.create(
         messages=[
             {
                 "role": "user",
@@ -122,7 +356,7 @@ def run_assistant(file_path):
         ]
     )
 
-    run = client.beta.threads.runs.create_and_poll(
+    run = assistant_client.beta.threads.runs.create_and_poll(
         thread_id=thread.id, assistant_id=assistant.id
     )
     if run.status == 'completed':
@@ -133,7 +367,7 @@ def run_assistant(file_path):
         logger.print(f'prompt_tokens: {run.usage.prompt_tokens}')
         logger.print(f'total_tokens: {run.usage.total_tokens}')
 
-    messages = list(client.beta.threads.messages.list(thread_id=thread.id, run_id=run.id))
+    messages = list(assistant_client.beta.threads.messages.list(thread_id=thread.id, run_id=run.id))
     response = messages[0].content[0].text.value
     return response
 
@@ -0,0 +1,93 @@
+import os
+import sys
+import threading
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+import pytesseract
+from pytesseract import Output
+
+try:  # tesseract C API: языки загружаются один раз на поток, без запуска tesseract.exe на каждый вызов
+    import tesserocr
+    from tesserocr import PyTessBaseAPI, PSM, RIL, iterate_level
+except ImportError:
+    tesserocr = None
+
+DATA_COLUMNS = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+                'left', 'top', 'width', 'height', 'conf', 'text']
+
+
+def to_pil(image: np.ndarray | Image.Image) -> Image.Image:
+    return image if isinstance(image, Image.Image) else Image.fromarray(image)
+
+
+class OcrEngine:
+    """ OSD и распознавание слов через один API: tesserocr (резидентные PyTessBaseAPI, по одному на поток
+    и (lang, psm)) или pytesseract (запуск tesseract на каждый вызов), если tesserocr не установлен """
+
+    def __init__(self):
+        self.backend = 'tesserocr' if tesserocr is not None else 'pytesseract'
+        self.tessdata = None
+        if getattr(sys, 'frozen', False):
+            bundle_dir = os.path.join(sys._MEIPASS, 'Tesseract-OCR')
+            pytesseract.pytesseract.tesseract_cmd = os.path.join(bundle_dir, 'tesseract.exe')
+            self.tessdata = os.path.join(bundle_dir, 'tessdata')
+        self.local = threading.local()
+
+    def api(self, lang: str, psm) -> 'PyTessBaseAPI':
+        """ PyTessBaseAPI текущего потока (API tesseract не потокобезопасен) """
+
+        if not hasattr(self.local, 'apis'):
+            self.local.apis = {}
+        apis = self.local.apis
+        if (lang, psm) not in apis:
+            kwargs = {'path': self.tessdata} if self.tessdata else {}
+            apis[(lang, psm)] = PyTessBaseAPI(lang=lang, psm=psm, **kwargs)
+        return apis[(lang, psm)]
+
+    def osd(self, image: np.ndarray | Image.Image) -> tuple[int, float]:
+        """ (rotate, confidence): rotate - поворот по часовой стрелке до вертикального положения (как 'Rotate' в
+        pytesseract.image_to_osd) """
+
+        if self.backend == 'pytesseract':
+            osd = pytesseract.image_to_osd(to_pil(image), output_type=Output.DICT)
+            return int(osd['rotate']), float(osd['orientation_conf'])
+
+        api = self.api('osd', PSM.OSD_ONLY)
+        api.SetImage(to_pil(image))
+        osd = api.DetectOrientationScript()
+        if not osd:
+            raise RuntimeError('tesseract OSD failed')
+        return (360 - osd['orient_deg']) % 360, float(osd['orient_conf'])
+
+    def data(self, image: np.ndarray | Image.Image, lang: str = 'eng+rus') -> pd.DataFrame:
+        """ слова с координатами в формате pytesseract.image_to_data(output_type=DATAFRAME)
+        (tesserocr - только строки уровня слов, level 5) """
+
+        if self.backend == 'pytesseract':
+            return pytesseract.image_to_data(to_pil(image), output_type=Output.DATAFRAME, lang=lang)
+
+        api = self.api(lang, PSM.AUTO)
+        api.SetImage(to_pil(image))
+        api.Recognize()
+        rows = []
+        block_num = par_num = line_num = word_num = 0
+        for word in iterate_level(api.GetIterator(), RIL.WORD):
+            if word.IsAtBeginningOf(RIL.BLOCK):
+                block_num, par_num = block_num + 1, 0
+            if word.IsAtBeginningOf(RIL.PARA):
+                par_num, line_num = par_num + 1, 0
+            if word.IsAtBeginningOf(RIL.TEXTLINE):
+                line_num, word_num = line_num + 1, 0
+            word_num += 1
+            bbox = word.BoundingBox(RIL.WORD)
+            if bbox is None:
+                continue
+            left, top, right, bottom = bbox
+            rows.append([5, 1, block_num, par_num, line_num, word_num, left, top, right - left, bottom - top,
+                         word.Confidence(RIL.WORD), word.GetUTF8Text(RIL.WORD)])
+        return pd.DataFrame(rows, columns=DATA_COLUMNS)
+
+
+ocr = OcrEngine()
@@ -0,0 +1,48 @@
+import re
+import pandas as pd
+from PIL import Image
+from time import perf_counter
+
+from config.config import config
+from src.ocr_engine import ocr
+from src.utils_tokens import estimate_text_tokens, estimate_image_tokens
+
+
+def ocr_page_text(image: Image.Image) -> tuple[str, list[float]]:
+    """ текст страницы (строки tesseract через перенос) и уверенности распознанных слов """
+
+    df = ocr.data(image, lang='eng+rus')
+    df = df[(df['conf'] >= 0) & df['text'].notna()]
+    df = df.assign(text=df['text'].astype(str).str.strip())
+    df = df[df['text'] != '']
+    lines = df.groupby(['page_num', 'block_num', 'par_num', 'line_num'])['text'].agg(' '.join)
+    return '\n'.join(lines), df['conf'].astype(float).tolist()
+
+
+def mean_conf(confs: list[float]) -> float:
+    return round(float(pd.Series(confs).mean()), 1) if confs else 0.0
+
+
+def choose_route(pages: list[Image.Image], image_sizes: list[tuple[int, int]], map_=map) -> tuple[str, str, dict]:
+    """ маршрут скана в модель: 'text' (локальный OCR чистый - средняя уверенность слов и номера контейнеров)
+    или 'image'. Сначала распознается первая страница: если уже она ниже ocr_route_min_conf, скан уходит
+    изображениями без OCR остальных страниц. Возвращает (route, OCR-текст, статистика для params.json) """
+
+    start = perf_counter()
+    results = [ocr_page_text(pages[0])]
+    if mean_conf(results[0][1]) >= config['ocr_route_min_conf']:
+        results += list(map_(ocr_page_text, pages[1:]))
+    text = '\n\n'.join(page_text for page_text, _ in results)
+    confs = [conf for _, page_confs in results for conf in page_confs]
+    stats = {'pages': len(results),
+             'words': len(confs),
+             'mean_conf': mean_conf(confs),
+             'containers': len(re.findall(config['container_regex'], text)),
+             'seconds': round(perf_counter() - start, 2),
+             'text_tokens': estimate_text_tokens(text),
+             'image_tokens': sum(estimate_image_tokens(*size, detail='high') for size in image_sizes)}
+    is_clean = (len(results) == len(pages)
+                and stats['words'] >= config['ocr_route_min_words']
+                and stats['mean_conf'] >= config['ocr_route_min_conf']
+                and stats['containers'] >= config['ocr_route_min_containers'])
+    return 'text' if is_clean else 'image', text, stats
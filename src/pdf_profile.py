@@ -0,0 +1,85 @@
+import re
+import fitz
+
+from config.config import config
+from src.logger import logger
+
+# допустимые символы текста коносамента (латиница, кириллица, цифры, пунктуация)
+PRINTABLE_REGEX = r'[A-Za-zА-Яа-яЁё0-9\s.,:;!?/\\\-()\[\]#№%&\'"+*@=_<>$€]'
+# слова, которые есть почти в любом коносаменте; для искаженного (CID) текста совпадений нет
+KEYWORDS = {'shipper', 'consignee', 'notify', 'vessel', 'voyage', 'port', 'loading', 'discharge', 'delivery',
+            'container', 'seal', 'weight', 'gross', 'packages', 'description', 'goods', 'bill', 'lading', 'freight',
+            'cargo', 'measurement', 'отправитель', 'получатель', 'грузоотправитель', 'грузополучатель', 'судно',
+            'порт', 'погрузки', 'выгрузки', 'контейнер', 'пломба', 'вес', 'груз', 'коносамент', 'мест'}
+
+
+def score_text_quality(text: str) -> dict:
+    """ оценка извлеченного текста 0..1: доля допустимых символов (0.5), найденные ключевые слова (0.3, 4+ слова -
+    полный балл), номер контейнера (0.2) """
+
+    printable_ratio = len(re.findall(PRINTABLE_REGEX, text)) / len(text) if text else 0.0
+    words = set(re.findall(r'[a-zа-яё]{3,}', text.lower()))
+    keyword_hits = len(words & KEYWORDS)
+    has_container = re.search(config['container_regex'], text) is not None
+    score = 0.5 * printable_ratio + 0.3 * min(keyword_hits / 4, 1.0) + 0.2 * has_container
+    return {'score': round(score, 3), 'printable_ratio': round(printable_ratio, 3),
+            'keyword_hits': keyword_hits, 'has_container': has_container}
+
+
+class PdfProfile:
+    """ профиль pdf за одно открытие fitz: количество страниц, текст каждой страницы, длина текста,
+    тип (сканированный / цифровой), качество текста и набор "чистых" страниц (без пустых и сплошного текста) """
+
+    scanned_min_chars = 30  # страница с меньшим количеством символов считается сканированной
+    waste_min_chars = 50  # пустая страница или сканированная (нераспознаваемая)
+    waste_max_chars = 8000  # страница сплошного текста (условия перевозки и т.п.)
+
+    def __init__(self, pdf_path: str):
+        self.pdf_path = pdf_path
+        self.document = fitz.open(pdf_path)
+        self.page_count = len(self.document)
+        self.texts = [page.get_text() for page in self.document]
+        self.text_lengths = [len(text.strip()) for text in self.texts]
+        self._text_quality = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        self.document.close()
+
+    @property
+    def is_scanned(self) -> bool:
+        scan_list = [i for i, length in enumerate(self.text_lengths) if length <= self.scanned_min_chars]
+        if not scan_list:
+            return False
+        if len(scan_list) == self.page_count:
+            return True
+        logger.print(f'! PdfProfile.is_scanned: mixed pages types in {self.pdf_path} !')
+        return 0 in scan_list  # определяем по первой странице
+
+    @property
+    def text_quality(self) -> dict:
+        """ score_text_quality текста чистых страниц (они отправляются в модель) """
+
+        if self._text_quality is None:
+            pages = self.cleaned_pages or range(self.page_count)
+            self._text_quality = score_text_quality('\n'.join(self.texts[i] for i in pages))
+        return self._text_quality
+
+    @property
+    def cleaned_pages(self) -> list[int]:
+        return [i for i, length in enumerate(self.text_lengths)
+                if self.waste_min_chars <= length <= self.waste_max_chars]
+
+    def save_cleaned(self, output_path: str) -> None:
+        """ сохраняет pdf только с cleaned_pages """
+
+        cleaned = fitz.open()
+        for page_num in self.cleaned_pages:
+            cleaned.insert_pdf(self.document, from_page=page_num, to_page=page_num)
+        cleaned.save(output_path)
+        cleaned.close()
@@ -0,0 +1,117 @@
+import sys
+import fitz
+import numpy as np
+from time import perf_counter
+
+from config.config import config
+from src.logger import logger
+
+
+def render_page(page: fitz.Page, dpi: int) -> np.ndarray:
+    """ страница pdf -> RGB np.ndarray (рендер в памяти, без временных файлов) """
+
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csRGB, alpha=False)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
+
+def extract_page_image(document: fitz.Document, page: fitz.Page) -> np.ndarray | None:
+    """ оригинальное изображение страницы-скана без рендера (поток JPEG/JBIG2/... декодируется как есть).
+    None, если страница не является одним изображением на весь лист: несколько изображений, текст,
+    векторная графика, повернутое или отраженное размещение изображения """
+
+    infos = page.get_image_info(xrefs=True)
+    if len(page.get_images(full=True)) != 1 or len(infos) != 1:
+        return None
+    info = infos[0]
+    a, b, c, d, e, f = info['transform']
+    if abs(b) > 1e-3 or abs(c) > 1e-3 or a <= 0 or d <= 0:  # не "прямое" размещение
+        return None
+    if fitz.Rect(info['bbox']).get_area() < config['embedded_min_coverage'] * page.rect.get_area():
+        return None
+    if len(page.get_text().strip()) > 30 or page.get_drawings():  # смешанная страница
+        return None
+
+    pix = fitz.Pixmap(document, info['xref'])
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.n not in (1, 3):  # CMYK, indexed и т.п.
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    image = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    if pix.n == 1:
+        image = image[:, :, 0]
+    if page.rotation:  # поворот страницы по часовой стрелке
+        image = np.ascontiguousarray(np.rot90(image, k=-(page.rotation // 90)))
+    return image
+
+
+def rasterize_fitz(pdf_path: str, last_page: int, dpi: int, document: fitz.Document | None = None) -> list[np.ndarray]:
+    """ первые last_page страниц через PyMuPDF. document - уже открытый pdf_path (PdfProfile.document).
+    Страницы-сканы берутся из встроенного изображения (config['extract_embedded_images']), остальные рендерятся """
+
+    if document is None:
+        with fitz.open(pdf_path) as document:
+            return rasterize_fitz(pdf_path, last_page, dpi, document)
+
+    images = []
+    for page_num in range(min(last_page, len(document))):
+        page = document[page_num]
+        start = perf_counter()
+        image = extract_page_image(document, page) if config['extract_embedded_images'] else None
+        method = 'embedded'
+        if image is None:
+            image = render_page(page, dpi)
+            method = 'rendered'
+        logger.print(f'page {page_num}: {method} {image.shape[1]}x{image.shape[0]}, {perf_counter() - start:.3f}s')
+        images.append(image)
+    return images
+
+
+def rasterize_poppler(pdf_path: str, last_page: int, dpi: int) -> list[np.ndarray]:
+    """ первые last_page страниц через pdftoppm (poppler) """
+
+    from pdf2image import convert_from_path
+
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=0, last_page=last_page, fmt='jpg',
+                               jpegopt={"quality": 100},
+                               poppler_path=config["POPPLER_PATH"])
+    return list(map(lambda x: np.array(x), images))
+
+
+def rasterize_pdf(pdf_path: str, last_page: int = 3, dpi: int | None = None, backend: str | None = None,
+                  document: fitz.Document | None = None) -> list[np.ndarray]:
+    """ backend: 'fitz' | 'poppler' (по умолчанию config['raster_backend']) """
+
+    dpi = dpi or config['raster_dpi']
+    backend = backend or config['raster_backend']
+    if backend == 'poppler':
+        return rasterize_poppler(pdf_path, last_page, dpi)
+    if backend == 'fitz':
+        return rasterize_fitz(pdf_path, last_page, dpi, document)
+    raise ValueError(f'unknown raster backend: {backend}')
+
+
+def compare_backends(pdf_path: str, last_page: int = 3, dpi: int | None = None) -> list[dict]:
+    """ сверка fitz и poppler: размеры страниц, среднее абсолютное отличие пикселей, время """
+
+    results = []
+    timings = {}
+    pages = {}
+    for backend in ['fitz', 'poppler']:
+        start = perf_counter()
+        pages[backend] = rasterize_pdf(pdf_path, last_page, dpi, backend)
+        timings[backend] = perf_counter() - start
+
+    for i, (fitz_page, poppler_page) in enumerate(zip(pages['fitz'], pages['poppler'])):
+        result = {'page': i, 'fitz_shape': fitz_page.shape, 'poppler_shape': poppler_page.shape}
+        if fitz_page.shape == poppler_page.shape:
+            result['mean_abs_diff'] = float(np.abs(fitz_page.astype(np.int16) - poppler_page).mean())
+        results.append(result)
+        logger.print(result)
+    logger.print(f"time: fitz {timings['fitz']:.2f}s, poppler {timings['poppler']:.2f}s")
+    return results
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        logger.print(path)
+        compare_backends(path)
@@ -0,0 +1,112 @@
+import time
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+import openai
+
+
+class TokenBucket:
+    """ ведро токенов: capacity в минуту, пополняется равномерно """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60  # в секунду
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """ сколько секунд ждать, пока в ведре будет amount (amount ограничен capacity) """
+
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateGovernor:
+    """ client-side rate limit для запросов к openai:
+    - RPM и TPM ведра (токены запроса оцениваются заранее);
+    - AIMD: при 429 лимит одновременных запросов делится пополам, при успехе растет на 1/limit;
+    - Retry-After: после 429 новые запросы не выпускаются до истечения паузы.
+    Потокобезопасен, используется и из синхронного (acquire), и из асинхронного (aacquire) кода """
+
+    poll_interval = 0.05
+
+    def __init__(self, rpm: int, tpm: int, max_concurrency: int, min_concurrency: int = 1):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def try_acquire(self, tokens: int) -> float:
+        """ 0 -> слот выдан; иначе - сколько секунд подождать до следующей попытки """
+
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.in_flight >= int(self.limit):
+                return self.poll_interval
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self.in_flight += 1
+            return 0.0
+
+    def acquire(self, tokens: int) -> None:
+        while (wait := self.try_acquire(tokens)) > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int) -> None:
+        while (wait := self.try_acquire(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+    def release(self, succeeded: bool = True, throttled: bool = False, retry_after: float = 0.0) -> None:
+        with self.lock:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.limit = max(float(self.min_concurrency), self.limit / 2)
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            elif succeeded:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+
+
+def retry_after_seconds(error: openai.RateLimitError, default: float) -> float:
+    """ пауза из заголовков ответа 429: retry-after-ms | retry-after (секунды или HTTP-дата) """
+
+    headers = error.response.headers if error.response is not None else {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            value = headers['retry-after']
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return default
+
+
+def is_quota_exceeded(error: openai.RateLimitError) -> bool:
+    """ 429 insufficient_quota - повторять бесполезно """
+
+    return getattr(error, 'code', None) == 'insufficient_quota'
@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+from config.config import config
+from src.logger import logger
+
+
+def ink_mask(image: Image.Image) -> np.ndarray:
+    """ True - пиксели текста/линий (Otsu по grayscale) """
+
+    gray = np.asarray(image.convert('L'))
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    return binary > 0
+
+
+def ink_bbox(mask: np.ndarray, min_ink: int = 3) -> tuple[int, int, int, int] | None:
+    """ (x1, y1, x2, y2) строк и столбцов, где не меньше min_ink пикселей текста (шум и пыль отбрасываются) """
+
+    rows = np.flatnonzero(mask.sum(axis=1) >= min_ink)
+    cols = np.flatnonzero(mask.sum(axis=0) >= min_ink)
+    if rows.size == 0 or cols.size == 0:
+        return None
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def collapse_blank_rows(region: np.ndarray, mask: np.ndarray, max_gap: int) -> np.ndarray:
+    """ пустые горизонтальные полосы выше max_gap пикселей сжимаются до max_gap """
+
+    blank = mask.sum(axis=1) == 0
+    keep = np.ones(len(blank), dtype=bool)
+    run = 0
+    for i, is_blank in enumerate(blank):
+        run = run + 1 if is_blank else 0
+        if run > max_gap:
+            keep[i] = False
+    return region[keep]
+
+
+def trim_region(image: Image.Image, mask: np.ndarray, top: int, bottom: int) -> np.ndarray | None:
+    """ полоса страницы [top, bottom) без белых полей и длинных пустых промежутков """
+
+    band_mask = mask[top:bottom]
+    bbox = ink_bbox(band_mask)
+    if bbox is None:
+        return None
+    x1, y1, x2, y2 = bbox
+    margin = config['roi_margin']
+    x1, y1 = max(x1 - margin, 0), max(y1 - margin, 0)
+    x2, y2 = min(x2 + margin, band_mask.shape[1]), min(y2 + margin, band_mask.shape[0])
+    region = np.asarray(image)[top + y1:top + y2, x1:x2]
+    return collapse_blank_rows(region, band_mask[y1:y2, x1:x2], max_gap=config['roi_max_gap'])
+
+
+def stack_regions(regions: list[np.ndarray], separator: int) -> np.ndarray:
+    """ регионы друг под другом на белом фоне, выравнивание по левому краю """
+
+    width = max(region.shape[1] for region in regions)
+    height = sum(region.shape[0] for region in regions) + separator * (len(regions) - 1)
+    canvas = np.full((height, width, *regions[0].shape[2:]), 255, dtype=regions[0].dtype)
+    y = 0
+    for region in regions:
+        canvas[y:y + region.shape[0], :region.shape[1]] = region
+        y += region.shape[0] + separator
+    return canvas
+
+
+def trim_page(image: Image.Image, table_coords: dict | None) -> Image.Image:
+    """ обрезка страницы: часть выше строки заголовка таблицы (get_table_coords) и часть с таблицей
+    обрезаются по краям текста, длинные пустые промежутки сжимаются, обе части складываются друг под другом.
+    Содержимое страницы не отбирается (логотипы, условия, подписи остаются) - убираются только пустые поля.
+    Без table_coords - страница целиком без полей """
+
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+    mask = ink_mask(image)
+    split = int(table_coords['min_top']) if table_coords is not None else 0
+    bands = [(0, split), (split, image.height)] if split > 0 else [(0, image.height)]
+    regions = [region for top, bottom in bands if (region := trim_region(image, mask, top, bottom)) is not None]
+    if not regions:
+        return image
+    composed = Image.fromarray(stack_regions(regions, separator=config['roi_max_gap']))
+    logger.print(f'page trim: {image.width}x{image.height} -> {composed.width}x{composed.height} '
+                 f'({composed.width * composed.height / (image.width * image.height):.0%} of page pixels)')
+    return composed
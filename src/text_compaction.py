@@ -0,0 +1,90 @@
+import re
+
+from config.config import config
+from src.logger import logger
+from src.utils_tokens import count_text_tokens
+
+# фразы условий перевозки / юридических оговорок: строка-проза с такой фразой начинает блок boilerplate,
+# блок - следующие строки-проза до первой строки-поля или строки груза (strip_boilerplate)
+BOILERPLATE_REGEX = re.compile(
+    r"shipped on board|received by the carrier|in apparent good order|in witness whereof|"
+    r"subject to (?:all )?the terms|terms and conditions|carrier'?s liability|hague(?:[- ]visby)? rules|cogsa|"
+    r"see clause|on the reverse (?:hereof|side)|one of (?:which|the) bills? of lading being accomplished|"
+    r"merchant'?s? (?:shall|is|are) (?:responsible|liable)|weight, measure, marks", re.IGNORECASE)
+
+# строка груза: количество с единицей веса, объема или упаковки
+CARGO_REGEX = re.compile(r'\d[\d.,]*\s*(?:kgs?|kilos?|cbm|m3|pkgs?|packages|cartons|ctns|bags|pallets|pcs|units)\b',
+                         re.IGNORECASE)
+
+
+def normalize_line(line: str) -> str:
+    """ пробелы и табуляции внутри строки -> один пробел """
+
+    return re.sub(r'[ \t\u00a0]+', ' ', line).strip()
+
+
+def is_prose(line: str) -> bool:
+    """ строка сплошного текста (продолжение абзаца условий), а не поле или строка таблицы """
+
+    words = line.split()
+    return len(line) >= 40 and len(words) >= 6 and sum(ch.isalpha() for ch in line) / len(line) > 0.7
+
+
+def is_cargo_line(line: str) -> bool:
+    return re.search(config['container_regex'], line) is not None or CARGO_REGEX.search(line) is not None
+
+
+def strip_boilerplate(lines: list[str]) -> list[str]:
+    """ удаляет абзацы условий перевозки: строка-проза с BOILERPLATE_REGEX и следующие за ней строки-проза.
+    Абзац заканчивается на первой строке-поле (не проза) или строке груза (контейнер, вес, упаковки) -
+    такие строки сохраняются """
+
+    kept, in_block = [], False
+    for line in lines:
+        if is_cargo_line(line) or not is_prose(line):
+            in_block = False
+        elif in_block or BOILERPLATE_REGEX.search(line):
+            in_block = True
+            continue
+        kept.append(line)
+    return kept
+
+
+def zone_indexes(lines: list[str], zone: int) -> set[int]:
+    """ индексы строк колонтитулов: первые и последние zone строк страницы, но не больше пятой части страницы
+    (на короткой странице все строки - данные) """
+
+    zone = min(zone, len(lines) // 5)
+    return set(range(zone)) | set(range(len(lines) - zone, len(lines)))
+
+
+def compact_pages(texts: list[str], min_line: int = 10, zone: int = 3) -> list[str]:
+    """ тексты страниц без повторяющихся колонтитулов (строка из первых/последних zone строк, которая есть в
+    колонтитулах каждой страницы, остается только на первой; строки с номером контейнера и строки короче
+    min_line не удаляются), без условий перевозки, с нормализованными пробелами и пустыми строками.
+    Строки таблицы (fitz - каждая ячейка отдельной строкой) повторяются между страницами и не удаляются """
+
+    pages = [[line for line in map(normalize_line, text.splitlines()) if line] for text in texts]
+    pages = [strip_boilerplate(lines) for lines in pages]
+    if len(pages) < 2:
+        return ['\n'.join(lines) for lines in pages]
+
+    zones = [zone_indexes(lines, zone) for lines in pages]
+    repeated = set.intersection(*({lines[i] for i in indexes} for lines, indexes in zip(pages, zones)))
+    repeated = {line for line in repeated
+                if len(line) >= min_line and re.search(config['container_regex'], line) is None}
+    compacted = ['\n'.join(pages[0])]
+    for lines, indexes in zip(pages[1:], zones[1:]):
+        compacted.append('\n'.join(line for i, line in enumerate(lines) if i not in indexes or line not in repeated))
+    return compacted
+
+
+def compact_texts(texts: list[str]) -> list[str]:
+    """ compact_pages с логом токенов до/после (tiktoken, если установлен и словарь скачан) """
+
+    if not config['compact_pdf_text']:
+        return texts
+    compacted = compact_pages(texts)
+    before, after = count_text_tokens('\n'.join(texts)), count_text_tokens('\n'.join(compacted))
+    logger.print(f'text compaction: {before} -> {after} tokens ({before - after} saved)')
+    return compacted
@@ -0,0 +1,68 @@
+import os
+import re
+
+from config.config import config
+from src.logger import logger
+from src.artifacts import ImageArtifact, load_artifact
+from src.utils_tokens import estimate_image_tokens
+
+# порядок повышения detail до high: зум таблицы товаров, страницы, обзорная страница (если есть ее зум)
+ROLE_PRIORITY = {'crop': 0, 'page': 1, 'overview': 2}
+
+
+def image_role(img_path: str) -> str:
+    """ по имени файла из main_edit: '<name>(0)_roi.jpg' - страница без пустых полей,
+    '<name>(1)_zoom.jpg' - зум таблицы, '<name>(0)_zoom.jpg' - вся страница одностраничного документа,
+    '<name>(i).jpg' - страница """
+
+    stem = os.path.splitext(img_path)[0]
+    if stem.endswith('_roi'):
+        return 'crop'
+    match = re.search(r'\((\d+)\)_zoom$', stem)
+    if match is None:
+        return 'page'
+    return 'overview' if match.group(1) == '0' else 'crop'
+
+
+def plan_details(sizes: list[tuple[int, int]], roles: list[str], budget: int) -> list[str]:
+    """ detail каждого изображения: все начинают с low, затем по приоритету роли повышаются до high,
+    пока стоимость документа укладывается в budget. Обзорная страница остается low,
+    если config['overview_detail'] == 'low' """
+
+    details = ['low'] * len(sizes)
+    spent = sum(estimate_image_tokens(*size, detail='low') for size in sizes)
+    for i in sorted(range(len(sizes)), key=lambda j: (ROLE_PRIORITY[roles[j]], j)):
+        if roles[i] == 'overview' and config['overview_detail'] == 'low':
+            continue
+        extra = estimate_image_tokens(*sizes[i], detail='high') - estimate_image_tokens(*sizes[i], detail='low')
+        if spent + extra <= budget:
+            details[i] = 'high'
+            spent += extra
+    return details
+
+
+class ImagePlan:
+    """ изображения запроса с выбранным detail """
+
+    def __init__(self, artifacts: list[ImageArtifact], roles: list[str], details: list[str]):
+        self.artifacts = artifacts
+        self.roles = roles
+        self.details = details
+
+    @property
+    def sizes(self) -> list[tuple[int, int]]:
+        return [artifact.size for artifact in self.artifacts]
+
+    @property
+    def image_tokens(self) -> int:
+        return sum(estimate_image_tokens(*size, detail) for size, detail in zip(self.sizes, self.details))
+
+
+def plan_images(*file_paths: str) -> ImagePlan:
+    artifacts = [load_artifact(img_path) for img_path in file_paths]
+    roles = [image_role(img_path) for img_path in file_paths]
+    details = plan_details([artifact.size for artifact in artifacts], roles, config['doc_image_token_budget'])
+    plan = ImagePlan(artifacts, roles, details)
+    logger.print('image plan:', ', '.join(f'{role}={detail}' for role, detail in zip(roles, details)),
+                 f'(~{plan.image_tokens} image tokens, budget {config["doc_image_token_budget"]})')
+    return plan
@@ -4,16 +4,19 @@ import io
 import fitz
 import json
 import glob
+import time
 import shutil
+import threading
+import cv2
 import base64
 import PyPDF2
 import openai
 import hashlib
-import pytesseract
 import numpy as np
 import pandas as pd
 from openai import OpenAI
 from typing import Optional
+from contextlib import contextmanager
 from datetime import datetime
 from dotenv import load_dotenv
 from io import BytesIO, StringIO
@@ -23,7 +26,8 @@ from PIL import Image, ImageDraw, ImageFont
 from config.config import config
 from src.logger import logger
 from src.utils_config import get_stream_dotenv
-from src.rotator import main as custom_rotate
+from src.rotator import estimate_skew, warp_oriented
+from src.ocr_engine import ocr
 
 
 # _____________________________________________________________________________________________________________ ENCODERS
@@ -54,6 +58,43 @@ def calculate_hash(file_path):
     return md5_hash.hexdigest()
 
 
+def write_atomic(path: str, text: str) -> None:
+    """ запись через временный файл + os.replace: читатель видит либо старый, либо новый файл целиком """
+
+    tmp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def file_lock(path: str, timeout: float = 30, stale: float = 60):
+    """ межпроцессная блокировка файлом <path>.lock (O_EXCL); lock-файл старше stale сек считается брошенным """
+
+    lock_path = f'{path}.lock'
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > stale:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'file lock {lock_path} is held for more than {timeout:.0f}s')
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.remove(lock_path)
+
+
 # _______________________________________________________________________________________________________________ COMMON
 
 
@@ -345,29 +386,64 @@ def image_upstanding(img: np.ndarray) -> np.ndarray:
     """ Приведение изображений в вертикальное положение с помощью tesseract"""
 
     pil_img = Image.fromarray(img)
-    osd = pytesseract.image_to_osd(pil_img)
-    rotation = int(osd.split("\n")[2].split(":")[1].strip())
-    confidence = float(osd.split("\n")[3].split(":")[1].strip())
+    rotation, confidence = ocr.osd(pil_img)
     # logger.print('rotation:', rotation, 'confidence:', confidence)
     if confidence > 3:
         return np.array(pil_img.rotate(-rotation, expand=True))
     return img
 
 
-def image_upstanding_and_rotate(image: np.ndarray) -> Image.Image:
+def downscale(image: np.ndarray, max_side: int) -> np.ndarray:
+    h, w = image.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+
+
+def estimate_orientation(image: np.ndarray) -> dict:
+    """ поворот 0/90/180/270 (tesseract OSD) и угол наклона (config['deskew_engine']) по уменьшенным копиям страницы:
+    OSD - до config['osd_max_side'], deskew - до config['deskew_max_side'] по большей стороне """
+
+    rotate, confidence = 0, 0.0
+    osd_level = downscale(image, config['osd_max_side'])
     try:
-        upstanding = image_upstanding(image)  # 0-90-180-270 rotate
+        rotation, confidence = ocr.osd(osd_level)
+        if confidence > 3:
+            rotate = rotation
     except:
-        upstanding = image
+        pass
+
+    deskew_level = np.ascontiguousarray(np.rot90(downscale(osd_level, config['deskew_max_side']), k=-(rotate // 90)))
     try:
-        rotated = custom_rotate(upstanding)  # accurate rotate
+        angle, deskew_confidence = estimate_skew(deskew_level, scale=max(deskew_level.shape[:2]) / max(image.shape[:2]),
+                                                 engine=config['deskew_engine'])
     except:
-        rotated = upstanding
-    rotated = Image.fromarray(rotated)
+        angle, deskew_confidence = 0.0, 0.0
+    # ровная страница или ненадежный угол -> без deskew (и без warpAffine, если нет поворота)
+    if abs(angle) < config['deskew_min_angle'] or deskew_confidence < config['deskew_min_confidence']:
+        angle = 0.0
+    return {'rotate': rotate, 'angle': round(angle, 3), 'osd_confidence': confidence,
+            'deskew_confidence': round(deskew_confidence, 3)}
+
+
+def apply_orientation(image: np.ndarray, transform: dict) -> Image.Image:
+    """ transform из estimate_orientation применяется одним warpAffine """
+
+    rotated = Image.fromarray(warp_oriented(image, transform['rotate'], transform['angle']))
     if rotated.mode == "RGBA":
         rotated = rotated.convert('RGB')
     return rotated
 
+
+def image_upstanding_and_rotate(image: np.ndarray) -> tuple[Image.Image, dict]:
+    """ OSD + deskew: возвращает выровненную страницу и transform (для params.json) """
+
+    image = np.asarray(image)
+    transform = estimate_orientation(image)
+    logger.print(f"orientation: rotate {transform['rotate']}, angle {transform['angle']:.2f}")
+    return apply_orientation(image, transform), transform
+
 # __________________________________________________________________________________________________________________ PDF
 
 def is_scanned_pdf(file_path, pages_to_analyse=None) -> Optional[bool]:
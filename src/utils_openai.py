@@ -1,13 +1,27 @@
+import os
+import json
+import asyncio
+from glob import glob
+
 from config.config import config
-from src.utils import extract_text_with_fitz, extract_excel_text
-from src.main_openai import run_chat, run_assistant
+from src.logger import logger
+from src.utils import extract_excel_text
+from src.pdf_profile import PdfProfile
+from src.text_compaction import compact_texts
+from src.main_openai import run_chat, arun_chat, run_assistant
+
+
+def read_pdf_texts(file: str) -> list[str]:
+    with PdfProfile(file) as profile:
+        return profile.texts
 
 
 def pdf_to_ai(file: str, test_mode: bool, text_to_assistant: bool, config: dict, running_params: dict,
               response_format=config['response_format']) -> str:
 
     running_params.setdefault('text_or_scanned_folder', config['NAME_text'])
-    running_params.setdefault('current_texts', extract_text_with_fitz(file))
+    if 'current_texts' not in running_params:
+        running_params['current_texts'] = read_pdf_texts(file)
     running_params.setdefault('doc_type', 'pdf')
 
     if test_mode:
@@ -15,7 +29,7 @@ def pdf_to_ai(file: str, test_mode: bool, text_to_assistant: bool, config: dict,
             return f.read()
     if not text_to_assistant:
         result = run_chat(file,
-                          response_format=response_format, text_content=running_params['current_texts'])
+                          response_format=response_format, text_content=compact_texts(running_params['current_texts']))
         return result
     else:
         result = run_assistant(file)
@@ -34,12 +48,85 @@ def excel_to_ai(file: str, test_mode: bool, text_to_assistant: bool, config: dic
     return result
 
 
+def read_ocr_text(files: list) -> str | None:
+    """ OCR-текст скана, если main_edit выбрал для него route 'text' (params.json, <name>_ocr.txt в EDITED/<folder>) """
+
+    folder = os.path.dirname(files[0])
+    with open(os.path.join(folder, 'params.json'), 'r', encoding='utf-8') as f:
+        params = json.load(f)
+    text_files = glob(os.path.join(folder, '*_ocr.txt'))
+    if params.get('route') != 'text' or not text_files:
+        return None
+    with open(text_files[0], 'r', encoding='utf-8') as f:
+        text = f.read()
+    stats = params['ocr']
+    logger.print(f"ocr route: text ~{stats['text_tokens']} tokens instead of images ~{stats['image_tokens']} tokens "
+                 f"(ocr {stats['seconds']}s, mean conf {stats['mean_conf']}, containers {stats['containers']})")
+    return text
+
+
 def images_to_ai(files: list, test_mode: bool, text_to_assistant: bool, config: dict, running_params: dict) -> str:
     running_params['text_or_scanned_folder'] = config['NAME_scanned']
     files.sort(reverse=True)
     if test_mode:
         with open(config['TESTFILE'], 'r', encoding='utf-8') as f:
             return f.read()
+    if (ocr_text := read_ocr_text(files)) is not None:
+        running_params['route'] = 'text'
+        running_params['current_texts'] = [ocr_text]
+        return run_chat('', response_format=config['response_format'], text_content=running_params['current_texts'])
     result = run_chat(*files,
                       response_format=config['response_format'], text_content=None)
     return result
+
+
+# ___________________________ ASYNC ___________________________
+
+async def apdf_to_ai(file: str, test_mode: bool, text_to_assistant: bool, config: dict, running_params: dict,
+                     response_format=config['response_format']) -> str:
+
+    running_params.setdefault('text_or_scanned_folder', config['NAME_text'])
+    if 'current_texts' not in running_params:
+        running_params['current_texts'] = await asyncio.to_thread(read_pdf_texts, file)
+    running_params.setdefault('doc_type', 'pdf')
+
+    if test_mode:
+        with open(config['TESTFILE'], 'r', encoding='utf-8') as f:
+            return f.read()
+    if not text_to_assistant:
+        text_content = await asyncio.to_thread(compact_texts, running_params['current_texts'])
+        result = await arun_chat(file, response_format=response_format, text_content=text_content)
+        return result
+    else:
+        result = await asyncio.to_thread(run_assistant, file)
+        return result
+
+
+async def aexcel_to_ai(file: str, test_mode: bool, text_to_assistant: bool, config: dict,
+                       running_params: dict) -> str:
+    running_params['text_or_scanned_folder'] = config['NAME_text']
+    running_params['current_texts'] = extract_excel_text(file)
+    running_params['doc_type'] = 'excel'
+    if test_mode:
+        with open(config['TESTFILE'], 'r', encoding='utf-8') as f:
+            return f.read()
+    result = await arun_chat('',
+                             response_format=config['response_format'], text_content=running_params['current_texts'])
+    return result
+
+
+async def aimages_to_ai(files: list, test_mode: bool, text_to_assistant: bool, config: dict,
+                        running_params: dict) -> str:
+    running_params['text_or_scanned_folder'] = config['NAME_scanned']
+    files.sort(reverse=True)
+    if test_mode:
+        with open(config['TESTFILE'], 'r', encoding='utf-8') as f:
+            return f.read()
+    if (ocr_text := await asyncio.to_thread(read_ocr_text, files)) is not None:
+        running_params['route'] = 'text'
+        running_params['current_texts'] = [ocr_text]
+        return await arun_chat('', response_format=config['response_format'],
+                               text_content=running_params['current_texts'])
+    result = await arun_chat(*files,
+                             response_format=config['response_format'], text_content=None)
+    return result
@@ -0,0 +1,104 @@
+import os
+import sys
+import math
+import hashlib
+from functools import lru_cache
+
+from config.config import config
+
+try:  # токенизатор openai (необязательная зависимость); словари кодировок - в config['TIKTOKEN_CACHE']
+    os.environ.setdefault('TIKTOKEN_CACHE_DIR', config['TIKTOKEN_CACHE'])
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+TIKTOKEN_URL = 'https://openaipublic.blob.core.windows.net/encodings/{name}.tiktoken'
+
+
+# ___________________________ TOKEN ESTIMATION ___________________________
+
+def estimate_text_tokens(text: str) -> int:
+    """ грубая оценка количества токенов текста (без токенизатора) """
+
+    return math.ceil(len(text) / config['chars_per_token'])
+
+
+def encoding_name(model: str) -> str:
+    try:
+        return tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        return 'o200k_base'
+
+
+def is_encoding_cached(name: str) -> bool:
+    """ словарь кодировки уже скачан (tiktoken хранит его под sha1 от url) """
+
+    cache_key = hashlib.sha1(TIKTOKEN_URL.format(name=name).encode()).hexdigest()
+    return os.path.isfile(os.path.join(os.environ['TIKTOKEN_CACHE_DIR'], cache_key))
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """ tiktoken-кодировка модели или None (tiktoken не установлен / словарь не скачан). Без словаря tiktoken
+    обращается в сеть - здесь этого не происходит: словарь скачивается явно, python -m src.utils_tokens """
+
+    if tiktoken is None:
+        return None
+    name = encoding_name(model)
+    if not is_encoding_cached(name):
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:
+        return None
+
+
+def count_text_tokens(text: str, model: str = config['GPTMODEL']) -> int:
+    """ точное количество токенов текста (tiktoken со скачанным словарем), иначе - estimate_text_tokens """
+
+    encoding = get_encoding(model)
+    if encoding is None:
+        return estimate_text_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = 'high') -> int:
+    """ стоимость изображения для vision-модели (gpt-4o):
+    low -> 85; high -> вписываем в 2048x2048, короткую сторону к 768, 170 за каждый тайл 512x512 + 85 """
+
+    if detail == 'low':
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def estimate_request_tokens(prompt: str,
+                            content: str | list,
+                            image_sizes: list[tuple[int, int]] = (),
+                            details: list[str] | None = None,
+                            max_tokens: int = 0,
+                            response_format: dict | None = None) -> int:
+    """ оценка токенов запроса для rate limit (openai учитывает в TPM и max_tokens) """
+
+    tokens = estimate_text_tokens(prompt) + max_tokens
+    if isinstance(content, str):
+        tokens += estimate_text_tokens(content)
+    details = details or ['high'] * len(image_sizes)
+    for (width, height), detail in zip(image_sizes, details):
+        tokens += estimate_image_tokens(width, height, detail)
+    if response_format:
+        tokens += estimate_text_tokens(str(response_format))
+    return tokens
+
+
+if __name__ == '__main__':
+    # скачивание словаря кодировки config['GPTMODEL'] (или моделей из аргументов) в config['TIKTOKEN_CACHE']
+    if tiktoken is None:
+        sys.exit('tiktoken is not installed: pip install tiktoken')
+    for model_ in sys.argv[1:] or [config['GPTMODEL']]:
+        tiktoken.get_encoding(encoding_name(model_))
+        print(model_, encoding_name(model_), is_encoding_cached(encoding_name(model_)))